@@ -0,0 +1,121 @@
+import re
+from itertools import islice
+
+import pandas as pd
+
+from query_planner import QueryRejected
+
+# Tables /aggregate can read: (type column, numeric value column)
+AGGREGATE_TABLES = {
+    "health_metrics": ("metric_type", "value"),
+    "activity_tracking": ("activity_type", "value"),
+    "environmental_data": ("data_type", "value_num"),
+}
+
+# Groupings besides the table's type column. hour is the hour of day (0-23),
+# day the calendar date; state comes from devices_by_state.
+GROUP_COLUMNS = ("device_id", "state", "hour", "day")
+
+AGGREGATE_FUNCTIONS = ("count", "mean", "min", "max", "sum")
+PERCENTILE = re.compile(r"^p(\d{1,2}(?:\.\d+)?)$")  # e.g. p50, p95, p99.9
+BUCKET = re.compile(r"^(\d+)([smhd])$")  # e.g. 30s, 15m, 1h, 1d
+BUCKET_UNITS = {"s": "s", "m": "min", "h": "h", "d": "D"}
+
+CHUNK_ROWS = 50000  # Rows converted into a DataFrame at a time
+
+
+def parse_group_by(group_by, type_column):
+    columns = [column.strip() for column in group_by.split(",") if column.strip()]
+    allowed = GROUP_COLUMNS + (type_column,)
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise QueryRejected(
+            f"Unknown group_by {', '.join(unknown)}; use {', '.join(allowed)}"
+        )
+    return columns
+
+
+def parse_aggregates(aggregates):
+    """(output column, pandas function name or quantile) per requested aggregate."""
+    parsed = []
+    for name in (name.strip() for name in aggregates.split(",")):
+        if name in AGGREGATE_FUNCTIONS:
+            parsed.append((name, name))
+        elif PERCENTILE.match(name):
+            parsed.append((name, float(PERCENTILE.match(name).group(1)) / 100))
+        else:
+            raise QueryRejected(
+                f"Unknown aggregate {name!r}; use {', '.join(AGGREGATE_FUNCTIONS)} or pNN"
+            )
+    return parsed
+
+
+def parse_bucket(bucket):
+    """pandas frequency of a bucket size such as 15m, or None for no time buckets."""
+    if bucket is None:
+        return None
+    match = BUCKET.match(bucket)
+    if not match or int(match.group(1)) == 0:
+        raise QueryRejected(f"Invalid bucket {bucket!r}; use e.g. 30s, 15m, 1h or 1d")
+    return match.group(1) + BUCKET_UNITS[match.group(2)]
+
+
+def rows_to_frame(rows, columns):
+    """
+    Collect driver rows into a DataFrame, CHUNK_ROWS at a time, so the rows
+    are held as typed columns rather than as Python objects.
+    """
+    rows = iter(rows)
+    chunks = []
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        chunks.append(pd.DataFrame.from_records(chunk, columns=columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def aggregate_frame(frame, group_by, bucket, aggregates, states=None):
+    """
+    Aggregate the `value` column of `frame` (device_id, timestamp, value and
+    the type column) per group and time bucket. Returns the grid as a
+    DataFrame, one row per group.
+    """
+    if frame.empty:
+        return pd.DataFrame()
+    frame = frame.copy()
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"])
+    frame["value"] = pd.to_numeric(frame["value"], errors="coerce")
+    keys = list(group_by)
+    if "hour" in keys:
+        frame["hour"] = frame["timestamp"].dt.hour
+    if "day" in keys:
+        frame["day"] = frame["timestamp"].dt.strftime("%Y-%m-%d")
+    if "state" in keys:
+        frame["state"] = frame["device_id"].map(states or {})
+    if bucket is not None:
+        frame["bucket"] = frame["timestamp"].dt.floor(bucket)
+        keys.append("bucket")
+
+    values = frame.groupby(keys, sort=True)["value"] if keys else frame["value"]
+    results = {}
+    for name, function in aggregates:
+        if isinstance(function, float):
+            results[name] = values.quantile(function)
+        else:
+            results[name] = values.agg(function)
+    grid = pd.DataFrame(results).reset_index() if keys else pd.DataFrame([results])
+    if "count" in grid.columns:
+        grid["count"] = grid["count"].astype(int)
+    return grid
+
+
+def grid_records(grid):
+    """An aggregated grid as JSON-ready row dicts."""
+    grid = grid.copy()
+    if "bucket" in grid.columns:
+        grid["bucket"] = grid["bucket"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    # NaN (e.g. the mean of an empty group) becomes null
+    return grid.astype(object).where(grid.notna(), None).to_dict(orient="records")
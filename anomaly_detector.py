@@ -0,0 +1,255 @@
+import argparse
+import math
+import sys
+import time
+from array import array
+
+from cassandra_kafka_setup import TOPIC_NAME
+from cassandra_writer import CassandraWriteEngine, to_datetime
+from ingest_service import POLL_TIMEOUT_MS, RETRY_BACKOFF, setup_kafka_consumer
+from stream_sinks import record_table, setup_cassandra_session
+from wire_format import decode_message
+
+DETECTOR_GROUP_ID = "anomaly-detector"
+COMMIT_INTERVAL = 2.0  # Seconds between alert flushes and offset commits
+REPORT_INTERVAL = 30.0
+
+# Hard limits per metric as (low, high); None leaves that side open
+METRIC_BANDS = {
+    "heart_rate": (40.0, 185.0),
+    "stress_level": (None, 8.0),
+}
+Z_THRESHOLD = 4.0  # Standard deviations from the device's own baseline
+EWMA_ALPHA = 0.05  # Weight of the newest reading once the baseline is warm
+MIN_SAMPLES = 20  # Readings before a device's baseline is trusted
+ALERT_COOLDOWN = 300.0  # Seconds of event time between alerts per device and metric
+
+
+class AnomalyDetector:
+    """
+    Per-device running statistics for a few health metrics.
+
+    Each device gets a slot in flat arrays holding, per metric, the number of
+    readings, the mean, the variance and the time of the last alert (28 bytes
+    per device and metric). The slot is found through the `slots` dict, whose
+    entry per device (its id and slot number) usually costs more than the
+    arrays. The first readings are folded in with Welford's update (weight
+    1/n), after which the weight levels off at `alpha` and the baseline
+    becomes an exponentially weighted mean and variance that follows the
+    device. A reading is flagged when it falls outside its metric's band, or
+    when it is more than `z_threshold` standard deviations from a warm
+    baseline.
+    """
+
+    def __init__(self, bands=METRIC_BANDS, z_threshold=Z_THRESHOLD, alpha=EWMA_ALPHA,
+                 min_samples=MIN_SAMPLES, cooldown=ALERT_COOLDOWN):
+        self.bands = bands
+        self.metrics = list(bands)
+        self.metric_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.z_threshold = z_threshold
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+
+        self.slots = {}
+        self.count = array("I")
+        self.mean = array("d")
+        self.var = array("d")
+        self.last_alert = array("d")
+        self.flagged = 0
+        self.suppressed = 0
+
+    def _slot(self, device_id):
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = self.slots[device_id] = len(self.slots)
+            width = len(self.metrics)
+            self.count.extend([0] * width)
+            self.mean.extend([0.0] * width)
+            self.var.extend([0.0] * width)
+            self.last_alert.extend([-math.inf] * width)
+        return slot * len(self.metrics)
+
+    def check(self, metric_type, value, n, mean, var):
+        """Return why `value` is anomalous for this baseline, or None."""
+        low, high = self.bands[metric_type]
+        if low is not None and value < low:
+            return f"{metric_type} {value:g} is below the {low:g} limit"
+        if high is not None and value > high:
+            return f"{metric_type} {value:g} is above the {high:g} limit"
+        if n >= self.min_samples and var > 0:
+            z = (value - mean) / math.sqrt(var)
+            if abs(z) >= self.z_threshold:
+                direction = "above" if z > 0 else "below"
+                return (f"{metric_type} {value:g} is {abs(z):.1f} standard deviations "
+                        f"{direction} this device's mean of {mean:.1f}")
+        return None
+
+    def observe(self, device_id, metric_type, timestamp, value):
+        """
+        Score one reading against the device's baseline, then fold it in.
+        Returns a notifications row if it should raise an alert.
+        """
+        metric = self.metric_index.get(metric_type)
+        if metric is None:
+            return None
+        i = self._slot(device_id) + metric
+        value = float(value)
+        n = self.count[i]
+        mean = self.mean[i]
+        var = self.var[i]
+
+        reason = self.check(metric_type, value, n, mean, var)
+
+        n += 1
+        weight = max(1.0 / n, self.alpha)
+        delta = value - mean
+        self.count[i] = n
+        self.mean[i] = mean + weight * delta
+        self.var[i] = (1.0 - weight) * (var + weight * delta * delta)
+
+        if reason is None:
+            return None
+        self.flagged += 1
+        timestamp = to_datetime(timestamp)
+        seconds = timestamp.timestamp()
+        if abs(seconds - self.last_alert[i]) < self.cooldown:
+            self.suppressed += 1
+            return None
+        self.last_alert[i] = seconds
+        return {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "notification_type": "alert",
+            "content": reason,
+            "is_read": False,
+        }
+
+    def state_bytes(self):
+        arrays = sum(
+            column.itemsize * len(column)
+            for column in (self.count, self.mean, self.var, self.last_alert)
+        )
+        slots = sys.getsizeof(self.slots) + sum(
+            sys.getsizeof(device_id) + sys.getsizeof(slot)
+            for device_id, slot in self.slots.items()
+        )
+        return arrays + slots
+
+
+class AnomalyService:
+    """
+    Runs the detector over the topic in its own consumer group and writes
+    alerts to the notifications table. Offsets are committed only after every
+    alert raised since the previous commit has been written.
+    """
+
+    def __init__(self, consumer, writer, detector, commit_interval=COMMIT_INTERVAL):
+        self.consumer = consumer
+        self.writer = writer
+        self.detector = detector
+        self.commit_interval = commit_interval
+        self.pending = []
+        self.consumed = 0
+        self.alerts = 0
+        self.skipped = 0
+
+    def handle(self, message):
+        try:
+            data = decode_message(message.value)
+            table = record_table(data)
+        except Exception as e:
+            self.skipped += 1
+            print(f"Skipping undecodable record at {message.topic}/"
+                  f"{message.partition}@{message.offset}: {e}")
+            return
+        self.consumed += 1
+        if table != "health_metrics":
+            return
+        alert = self.detector.observe(
+            data["device_id"], data["metric_type"], data["timestamp"], data["value"]
+        )
+        if alert is not None:
+            self.pending.append(alert)
+
+    def commit(self):
+        """Write pending alerts, retrying until they land, then commit offsets."""
+        while self.pending:
+            failed_before = self.writer.rows_failed
+            self.writer.add_many("notifications", self.pending)
+            self.writer.flush()
+            if self.writer.rows_failed == failed_before:
+                self.alerts += len(self.pending)
+                self.pending = []
+                break
+            # Alerts are keyed by device, type and timestamp, so rewriting is safe
+            print(f"Alert write failed, retrying in {RETRY_BACKOFF:.0f}s")
+            time.sleep(RETRY_BACKOFF)
+        self.consumer.commit()
+
+    def report(self):
+        detector = self.detector
+        print(
+            f"Anomaly detector: {self.consumed} records, {len(detector.slots)} devices "
+            f"({detector.state_bytes() / 1e6:.1f} MB of state), {detector.flagged} "
+            f"anomalies, {self.alerts} alerts written, {detector.suppressed} "
+            f"suppressed by the cooldown"
+        )
+
+    def run(self):
+        last_commit = last_report = time.monotonic()
+        try:
+            while True:
+                batches = self.consumer.poll(timeout_ms=POLL_TIMEOUT_MS)
+                for messages in batches.values():
+                    for message in messages:
+                        self.handle(message)
+
+                now = time.monotonic()
+                if now - last_commit >= self.commit_interval:
+                    last_commit = now
+                    self.commit()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    self.report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.commit()
+            self.consumer.close()
+            self.report()
+            if self.skipped:
+                print(f"Skipped {self.skipped} undecodable records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Raise alerts for abnormal heart rate and stress readings on "
+                    f"the '{TOPIC_NAME}' topic"
+    )
+    parser.add_argument("--group-id", default=DETECTOR_GROUP_ID)
+    parser.add_argument("--heart-rate-band", type=float, nargs=2,
+                        default=METRIC_BANDS["heart_rate"], metavar=("LOW", "HIGH"))
+    parser.add_argument("--max-stress-level", type=float,
+                        default=METRIC_BANDS["stress_level"][1])
+    parser.add_argument("--z-threshold", type=float, default=Z_THRESHOLD)
+    parser.add_argument("--alpha", type=float, default=EWMA_ALPHA,
+                        help="EWMA weight of the newest reading")
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES)
+    parser.add_argument("--cooldown", type=float, default=ALERT_COOLDOWN,
+                        help="Seconds between alerts for one device and metric")
+    args = parser.parse_args()
+
+    detector = AnomalyDetector(
+        bands={
+            "heart_rate": tuple(args.heart_rate_band),
+            "stress_level": (None, args.max_stress_level),
+        },
+        z_threshold=args.z_threshold,
+        alpha=args.alpha,
+        min_samples=args.min_samples,
+        cooldown=args.cooldown,
+    )
+    consumer = setup_kafka_consumer(args.group_id)
+    writer = CassandraWriteEngine(setup_cassandra_session())
+    AnomalyService(consumer, writer, detector).run()
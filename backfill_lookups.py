@@ -0,0 +1,56 @@
+from cassandra.query import SimpleStatement
+
+from cassandra_writer import CassandraWriteEngine, DEDUPLICATED_LOOKUPS, lookup_rows
+from response_cache import SHARED_CACHE_PATH, ChangeNotifier, Generations
+from stream_sinks import setup_cassandra_session
+
+FETCH_SIZE = 5000  # Rows per page of the full-table scans
+
+
+def scan(session, table, columns):
+    statement = SimpleStatement(
+        f"SELECT {', '.join(columns)} FROM {table};", fetch_size=FETCH_SIZE
+    )
+    for row in session.execute(statement):
+        yield row._asdict()
+
+
+def backfill_lookups():
+    """
+    One-time fill of devices_by_state, environment_by_state_and_day and
+    dates_by_device from rows written before the write path maintained them.
+    """
+    session = setup_cassandra_session()
+    writer = CassandraWriteEngine(
+        session, notifier=ChangeNotifier(Generations(SHARED_CACHE_PATH))
+    )
+    environment_columns = ("device_id", "timestamp", "data_type", "value", "town", "state")
+
+    # Temperature and humidity rows only get a state through their device's
+    # location rows, so collect those first
+    places = {}
+    for data in scan(session, "environmental_data", environment_columns):
+        if data["state"]:
+            places[data["device_id"]] = (data["state"], data["town"] or "")
+
+    seen = set()
+    sources = (
+        ("environmental_data", environment_columns),
+        ("health_metrics", ("device_id", "timestamp")),
+        ("activity_tracking", ("device_id", "timestamp")),
+    )
+    for table, columns in sources:
+        for data in scan(session, table, columns):
+            for lookup_table, row in lookup_rows(table, data, places):
+                if lookup_table in DEDUPLICATED_LOOKUPS:
+                    key = (lookup_table,) + tuple(row.values())
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                writer.add(lookup_table, row)
+    writer.flush()
+    writer.report()
+
+
+if __name__ == "__main__":
+    backfill_lookups()
@@ -1,12 +1,50 @@
+import argparse
+
 from cassandra.cluster import Cluster
 from kafka.admin import KafkaAdminClient, NewTopic
 
+from time_buckets import BUCKET_UNITS
+
 BOOTSTRAP_SERVERS = "localhost:9092"
 TOPIC_NAME = "apple-watch-iots"
 NUM_PARTITIONS = 3
 REPLICATION_FACTOR = 1
 
-def create_keyspace_and_tables():
+# Retention of the time-series tables; 0 keeps rows forever
+DEFAULT_TTL_DAYS = 90
+
+# Tumbling windows rolled up from health_metrics, in seconds
+ROLLUP_WINDOWS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+def time_series_options(bucket, ttl_days):
+    """
+    Table options for append-only time-series tables: time-window compaction
+    with one window per bucket (a day unless the table is bucketed by week)
+    and a default TTL, so expired data is dropped a whole SSTable at a time.
+    """
+    window_size = 7 if bucket == "week" else 1
+    return (
+        "compaction = {'class': 'TimeWindowCompactionStrategy', "
+        "'compaction_window_unit': 'DAYS', "
+        f"'compaction_window_size': {window_size}}} "
+        f"AND default_time_to_live = {int(ttl_days * 86400)}"
+    )
+
+
+def create_keyspace_and_tables(bucket=None, ttl_days=DEFAULT_TTL_DAYS):
+    """
+    Create the keyspace and tables. With `bucket` set to "day" or "week" the
+    time-series tables are partitioned by (device_id, <bucket>), so no
+    partition grows beyond one device's readings for one day or week.
+    """
+    if bucket is not None and bucket not in BUCKET_UNITS:
+        raise ValueError(f"bucket must be one of {BUCKET_UNITS} or None")
+    partition_key = "device_id" if bucket is None else f"device_id, {bucket}"
+    bucket_column = "" if bucket is None else (
+        f"{bucket} date,  -- First day of the {bucket} the reading falls in\n        "
+    )
+    options = time_series_options(bucket, ttl_days)
+
     # Connect to Cassandra
     cluster = Cluster(["127.0.0.1"])
     session = cluster.connect()
@@ -36,42 +74,45 @@ def create_keyspace_and_tables():
     )
 
     session.execute(
-        """
+        f"""
     CREATE TABLE IF NOT EXISTS health_metrics (
         device_id text,
-        timestamp timestamp,
+        {bucket_column}timestamp timestamp,
         metric_type text,  -- e.g., 'heart_rate', 'calories_burned', 'stress_level'
         value float,
         unit text,         -- e.g., 'bpm', 'kcal', 'level'
-        PRIMARY KEY ((device_id), metric_type, timestamp)
-    ) WITH CLUSTERING ORDER BY (metric_type ASC, timestamp DESC);
+        PRIMARY KEY (({partition_key}), metric_type, timestamp)
+    ) WITH CLUSTERING ORDER BY (metric_type ASC, timestamp DESC) AND {options};
     """
     )
 
     session.execute(
-        """
+        f"""
     CREATE TABLE IF NOT EXISTS activity_tracking (
         device_id text,
-        timestamp timestamp,
+        {bucket_column}timestamp timestamp,
         activity_type text,  -- e.g., 'walking', 'running', 'cycling'
         value float,         -- e.g., steps, distance in meters
         unit text,           -- e.g., 'steps', 'meters', 'calories'
-        PRIMARY KEY ((device_id), activity_type, timestamp)
-    ) WITH CLUSTERING ORDER BY (activity_type ASC, timestamp DESC);
+        PRIMARY KEY (({partition_key}), activity_type, timestamp)
+    ) WITH CLUSTERING ORDER BY (activity_type ASC, timestamp DESC) AND {options};
     """
     )
 
     session.execute(
-        """
+        f"""
     CREATE TABLE IF NOT EXISTS environmental_data (
         device_id text,
-        timestamp timestamp,
+        {bucket_column}timestamp timestamp,
         data_type text,      -- e.g., 'temperature', 'humidity', 'location'
         value text,          -- Value depends on the data type (e.g., '25.3°C', '50%', 'latitude,longitude (location_name)')
         town text,
         state text,
-        PRIMARY KEY ((device_id), data_type, timestamp)
-    ) WITH CLUSTERING ORDER BY (data_type ASC, timestamp DESC);
+        value_num float,     -- Numeric temperature/humidity, null for locations
+        latitude double,     -- Location readings only
+        longitude double,
+        PRIMARY KEY (({partition_key}), data_type, timestamp)
+    ) WITH CLUSTERING ORDER BY (data_type ASC, timestamp DESC) AND {options};
     """
     )
 
@@ -101,6 +142,67 @@ def create_keyspace_and_tables():
     """
     )
 
+    # Lookup tables, one per API access pattern, kept in sync by the write path
+    session.execute(
+        """
+    CREATE TABLE IF NOT EXISTS devices_by_state (
+        state text,
+        device_id text,
+        town text,
+        PRIMARY KEY ((state), device_id)
+    );
+    """
+    )
+
+    session.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS environment_by_state_and_day (
+        state text,
+        day date,
+        data_type text,
+        timestamp timestamp,
+        device_id text,
+        value text,
+        town text,
+        value_num float,
+        PRIMARY KEY ((state, day), data_type, timestamp, device_id)
+    ) WITH CLUSTERING ORDER BY (data_type ASC, timestamp DESC, device_id ASC)
+      AND {time_series_options("day", ttl_days)};
+    """
+    )
+
+    # A day is written once, with its first reading, so it is kept a day
+    # longer than the readings it lists
+    days_ttl = int((ttl_days + 1) * 86400) if ttl_days else 0
+    session.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS dates_by_device (
+        device_id text,
+        day date,
+        PRIMARY KEY ((device_id), day)
+    ) WITH CLUSTERING ORDER BY (day DESC)
+      AND default_time_to_live = {days_ttl};
+    """
+    )
+
+    # Per-device rollups of health_metrics, one table per window size
+    for window in ROLLUP_WINDOWS:
+        session.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS health_metrics_{window} (
+            device_id text,
+            metric_type text,
+            timestamp timestamp,  -- Start of the window
+            value_count bigint,
+            value_sum double,
+            value_min double,
+            value_max double,
+            value_mean double,
+            PRIMARY KEY ((device_id), metric_type, timestamp)
+        ) WITH CLUSTERING ORDER BY (metric_type ASC, timestamp DESC);
+        """
+        )
+
     print("Keyspace and tables created successfully.")
 
 def create_kafka_topic(
@@ -130,7 +232,14 @@ def create_kafka_topic(
         admin_client.close()
 
 if __name__ == "__main__":
-    create_keyspace_and_tables()
+    parser = argparse.ArgumentParser(description="Create the Cassandra schema and Kafka topic")
+    parser.add_argument("--bucket", choices=BUCKET_UNITS,
+                        help="Also partition the time-series tables by day or week")
+    parser.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS,
+                        help="Default TTL of the time-series tables, 0 to keep rows forever")
+    args = parser.parse_args()
+
+    create_keyspace_and_tables(bucket=args.bucket, ttl_days=args.ttl_days)
 
     # Create Kafka topic
     create_kafka_topic(
@@ -0,0 +1,378 @@
+import time
+import weakref
+from collections import defaultdict
+from datetime import datetime
+
+from cassandra.query import UNSET_VALUE, BatchStatement, BatchType
+from cassandra.concurrent import execute_concurrent
+
+from cassandra_kafka_setup import ROLLUP_WINDOWS
+from time_buckets import bucket_start, table_bucket
+
+# Insert statement and bound column order for each table we write to
+INSERT_QUERIES = {
+    "health_metrics": (
+        """
+        INSERT INTO health_metrics (device_id, timestamp, metric_type, value, unit)
+        VALUES (?, ?, ?, ?, ?);
+        """,
+        ("device_id", "timestamp", "metric_type", "value", "unit"),
+    ),
+    "environmental_data": (
+        """
+        INSERT INTO environmental_data (device_id, timestamp, data_type, value, town, state, value_num, latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        ("device_id", "timestamp", "data_type", "value", "town", "state",
+         "value_num", "latitude", "longitude"),
+    ),
+    "activity_tracking": (
+        """
+        INSERT INTO activity_tracking (device_id, timestamp, activity_type, value, unit)
+        VALUES (?, ?, ?, ?, ?);
+        """,
+        ("device_id", "timestamp", "activity_type", "value", "unit"),
+    ),
+    "notifications": (
+        """
+        INSERT INTO notifications (device_id, timestamp, notification_type, content, is_read)
+        VALUES (?, ?, ?, ?, ?);
+        """,
+        ("device_id", "timestamp", "notification_type", "content", "is_read"),
+    ),
+    # Lookup tables mirroring the base tables for the API's access patterns
+    "devices_by_state": (
+        """
+        INSERT INTO devices_by_state (state, device_id, town)
+        VALUES (?, ?, ?);
+        """,
+        ("state", "device_id", "town"),
+    ),
+    "environment_by_state_and_day": (
+        """
+        INSERT INTO environment_by_state_and_day (state, day, data_type, timestamp, device_id, value, town, value_num)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        ("state", "day", "data_type", "timestamp", "device_id", "value", "town", "value_num"),
+    ),
+    "dates_by_device": (
+        """
+        INSERT INTO dates_by_device (device_id, day)
+        VALUES (?, ?);
+        """,
+        ("device_id", "day"),
+    ),
+}
+
+# Partition key columns of tables not partitioned by device_id alone
+PARTITION_KEYS = {
+    "devices_by_state": ("state",),
+    "environment_by_state_and_day": ("state", "day"),
+}
+
+# Lookup rows that repeat for every reading; written once per flush
+DEDUPLICATED_LOOKUPS = {"devices_by_state", "dates_by_device"}
+
+# Rollup tables written by the streaming aggregation stage
+ROLLUP_COLUMNS = (
+    "device_id", "metric_type", "timestamp", "value_count", "value_sum",
+    "value_min", "value_max", "value_mean",
+)
+for window in ROLLUP_WINDOWS:
+    INSERT_QUERIES[f"health_metrics_{window}"] = (
+        f"""
+        INSERT INTO health_metrics_{window} ({", ".join(ROLLUP_COLUMNS)})
+        VALUES ({", ".join("?" * len(ROLLUP_COLUMNS))});
+        """,
+        ROLLUP_COLUMNS,
+    )
+
+# Columns that default to an empty string when missing from a reading
+OPTIONAL_TEXT_COLUMNS = {"town", "state"}
+
+# Numeric columns parsed from environmental value strings when a reading
+# doesn't carry them
+ENVIRONMENT_NUMBER_COLUMNS = ("value_num", "latitude", "longitude")
+
+# Prepared statements per table, cached per live session
+_prepared_cache = weakref.WeakKeyDictionary()
+
+
+def prepare_insert(session, table):
+    """
+    Return the prepared INSERT for a table, preparing it only once per session.
+    Tables partitioned by a time bucket get the bucket column bound last.
+    """
+    statements = _prepared_cache.setdefault(session, {})
+    if table not in statements:
+        if table not in INSERT_QUERIES:
+            raise ValueError(f"Unknown table: {table}")
+        query, columns = INSERT_QUERIES[table]
+        bucket = table_bucket(session, table)
+        if bucket is not None:
+            columns = columns + (bucket,)
+            query = (
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))});"
+            )
+        statements[table] = session.prepare(query)
+    return statements[table]
+
+
+def to_datetime(value):
+    # Generators emit ISO strings, prepared statements need datetime objects
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def parse_environment_value(data_type, value):
+    """
+    Numeric form of an environmental value string ("25.3°C", "50.1%",
+    "lat, lon") as (value_num, latitude, longitude); parts that don't apply
+    or don't parse are None.
+    """
+    try:
+        if data_type == "location":
+            latitude, longitude = (float(part) for part in str(value).split(","))
+            return None, latitude, longitude
+        return float(str(value).rstrip("°C%")), None, None
+    except ValueError:
+        return None, None, None
+
+
+def bind_values(table, data, bucket=None):
+    """
+    Build the positional values of a prepared INSERT from a reading dict,
+    followed by the reading's time bucket if the table has one.
+    """
+    _, columns = INSERT_QUERIES[table]
+    values = []
+    numbers = None
+    for column in columns:
+        if column == "timestamp":
+            values.append(to_datetime(data["timestamp"]))
+        elif column in OPTIONAL_TEXT_COLUMNS:
+            values.append(data.get(column, ""))
+        elif column in ENVIRONMENT_NUMBER_COLUMNS and column not in data:
+            if numbers is None:
+                numbers = dict(zip(
+                    ENVIRONMENT_NUMBER_COLUMNS,
+                    parse_environment_value(data["data_type"], data["value"]),
+                ))
+            # Unset rather than null, so inapplicable columns leave no tombstones
+            value = numbers[column]
+            values.append(UNSET_VALUE if value is None else value)
+        else:
+            values.append(data[column])
+    if bucket is not None:
+        values.append(bucket_start(to_datetime(data["timestamp"]), bucket))
+    return tuple(values)
+
+
+def validate_record(table, data):
+    """Raise if a reading lacks a column of `table` or has a bad timestamp."""
+    bind_values(table, data)
+
+
+def lookup_rows(table, data, places):
+    """
+    Yield (table, row) for the lookup-table rows that mirror one reading.
+
+    Only location readings carry the town and state, so `places` remembers
+    them per device (device_id -> (state, town)) for the temperature and
+    humidity readings that follow. Rows of other tables, including the
+    lookup rows themselves, mirror nothing.
+    """
+    if table not in ("health_metrics", "activity_tracking", "environmental_data"):
+        return
+    timestamp = to_datetime(data["timestamp"])
+    device_id = data["device_id"]
+    # Days of every bucketed table, so the buckets of any of them can be found
+    yield "dates_by_device", {"device_id": device_id, "day": timestamp.date()}
+    if table == "environmental_data":
+        if data.get("state"):
+            places[device_id] = (data["state"], data.get("town", ""))
+        if device_id not in places:
+            return
+        state, town = places[device_id]
+        yield "devices_by_state", {"state": state, "device_id": device_id, "town": town}
+        yield "environment_by_state_and_day", {
+            "state": state,
+            "day": timestamp.date(),
+            "data_type": data["data_type"],
+            "timestamp": timestamp,
+            "device_id": device_id,
+            "value": data["value"],
+            "town": town,
+        }
+
+
+def partition_key(table, data, bucket=None):
+    key = tuple(data[column] for column in PARTITION_KEYS.get(table, ("device_id",)))
+    if bucket is not None:
+        key += (bucket_start(to_datetime(data["timestamp"]), bucket),)
+    return key
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class CassandraWriteEngine:
+    """
+    Buffered write path for the time-series tables.
+
+    Rows are buffered per table and flushed every `batch_size` rows. Readings
+    for the base tables also queue the rows of the lookup tables derived from
+    them (see `lookup_rows`); with a `notifier`, once lookup rows introducing
+    a new state, device or device day are written, the API's cached
+    responses they change are invalidated. A flush groups the rows by
+    partition key, packs each group into unlogged single-partition batches of
+    at most `rows_per_partition_batch` rows and sends them through the
+    driver's concurrent execution with at most `concurrency` requests in
+    flight.
+    """
+
+    def __init__(
+        self, session, concurrency=64, batch_size=1000, rows_per_partition_batch=50,
+        notifier=None,
+    ):
+        self.session = session
+        self.notifier = notifier
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.rows_per_partition_batch = rows_per_partition_batch
+
+        self._buffers = defaultdict(list)
+        self._buffered = 0
+        self._lookups_seen = set()
+        self._device_places = {}
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.batch_latencies = []
+        self.write_time = 0.0
+        self.started_at = time.perf_counter()
+
+    def add(self, table, data):
+        """Queue one reading for `table`, flushing when the buffer is full."""
+        self._buffers[table].append(data)
+        self._buffered += 1
+        for lookup_table, row in lookup_rows(table, data, self._device_places):
+            if lookup_table in DEDUPLICATED_LOOKUPS:
+                key = (lookup_table,) + tuple(row.values())
+                if key in self._lookups_seen:
+                    continue
+                self._lookups_seen.add(key)
+                if self.notifier is not None:
+                    self.notifier.observe(lookup_table, row)
+            self._buffers[lookup_table].append(row)
+            self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def add_many(self, table, rows):
+        for data in rows:
+            self.add(table, data)
+
+    def _partition_statements(self, table, rows):
+        prepared = prepare_insert(self.session, table)
+        bucket = table_bucket(self.session, table)
+
+        by_partition = defaultdict(list)
+        for data in rows:
+            by_partition[partition_key(table, data, bucket)].append(
+                bind_values(table, data, bucket)
+            )
+
+        statements = []
+        for values in by_partition.values():
+            for start in range(0, len(values), self.rows_per_partition_batch):
+                chunk = values[start : start + self.rows_per_partition_batch]
+                if len(chunk) == 1:
+                    statements.append((prepared, chunk[0], 1))
+                    continue
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for row_values in chunk:
+                    batch.add(prepared, row_values)
+                statements.append((batch, (), len(chunk)))
+        return statements
+
+    def flush(self):
+        """Write every buffered row and return the number of rows written."""
+        if not self._buffered:
+            return 0
+
+        statements = []
+        row_counts = []
+        for table, rows in self._buffers.items():
+            for statement, params, count in self._partition_statements(table, rows):
+                statements.append((statement, params))
+                row_counts.append(count)
+        self._buffers = defaultdict(list)
+        self._buffered = 0
+        self._lookups_seen.clear()
+
+        start = time.perf_counter()
+        results = execute_concurrent(
+            self.session,
+            statements,
+            concurrency=self.concurrency,
+            raise_on_first_error=False,
+        )
+        elapsed = time.perf_counter() - start
+
+        written = 0
+        failed = 0
+        for (success, result), count in zip(results, row_counts):
+            if success:
+                written += count
+            else:
+                failed += count
+                print(f"Cassandra write failed ({count} rows): {result}")
+        self.rows_failed += failed
+        # Changes are published only with a flush that stored every row; a
+        # caller that retries observes the rows of a failed one again
+        if self.notifier is not None:
+            if failed:
+                self.notifier.discard()
+            else:
+                self.notifier.publish()
+
+        self.rows_written += written
+        self.batch_latencies.append(elapsed)
+        self.write_time += elapsed
+        return written
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started_at
+        return {
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "batches": len(self.batch_latencies),
+            "rows_per_sec": self.rows_written / elapsed if elapsed else 0.0,
+            "write_rows_per_sec": (
+                self.rows_written / self.write_time if self.write_time else 0.0
+            ),
+            "batch_latency_p50_ms": percentile(self.batch_latencies, 50) * 1000,
+            "batch_latency_p99_ms": percentile(self.batch_latencies, 99) * 1000,
+            "batch_latency_max_ms": max(self.batch_latencies, default=0.0) * 1000,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            f"Cassandra writes: {stats['rows_written']} rows "
+            f"({stats['rows_failed']} failed) in {stats['batches']} batches, "
+            f"{stats['rows_per_sec']:.0f} rows/s overall, "
+            f"{stats['write_rows_per_sec']:.0f} rows/s while writing, "
+            f"batch latency p50={stats['batch_latency_p50_ms']:.1f}ms "
+            f"p99={stats['batch_latency_p99_ms']:.1f}ms "
+            f"max={stats['batch_latency_max_ms']:.1f}ms"
+        )
+        return stats
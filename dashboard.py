@@ -3,10 +3,16 @@ from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import requests
 import pandas as pd
+import pyarrow as pa
 import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 
+from response_formats import ARROW_STREAM, COLUMNAR_JSON
+
+# Points per series requested for line charts; the API downsamples to this
+CHART_POINTS = 1000
+
 # Initialize the Dash app
 app = dash.Dash(__name__)
 app.title = "Apple Watch IoT Data Dashboard"
@@ -32,6 +38,39 @@ def fetch_dates(device_id):
         return response.json()
     return []
 
+# Decode a table or aggregate response straight into a DataFrame: Arrow
+# streams and columnar JSON arrive column by column with timestamps already
+# typed, so nothing is parsed per row
+def decode_frame(response):
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith(ARROW_STREAM):
+        return pa.ipc.open_stream(response.content).read_pandas()
+    body = response.json()
+    if content_type.startswith(COLUMNAR_JSON):
+        df = pd.DataFrame(body["columns"])
+        for column in body["timestamp_columns"]:
+            df[column] = pd.to_datetime(df[column], unit="ms")
+        return df
+    df = pd.DataFrame(body)
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+# Fetch a table or aggregate endpoint as a DataFrame, preferring Arrow
+def fetch_frame(url, **params):
+    response = requests.get(
+        url,
+        params=params,
+        headers={"Accept": f"{ARROW_STREAM}, {COLUMNAR_JSON};q=0.9, application/json;q=0.5"},
+    )
+    if response.status_code != 200:
+        return pd.DataFrame()
+    return decode_frame(response)
+
+# Fetch an aggregated grid computed by the API's /aggregate endpoint
+def fetch_aggregate(**params):
+    return fetch_frame("http://127.0.0.1:5000/aggregate", **params)
+
 # Define the layout of the dashboard
 app.layout = html.Div(
     [
@@ -269,13 +308,10 @@ def update_health_metrics(n_clicks, device_id):
     HEALTH_METRICS = ["heart_rate", "calories_burned", "stress_level"]
 
     try:
-        response = requests.get(
-            f"http://127.0.0.1:5000/health_metrics?device_id={device_id}"
+        df = fetch_frame(
+            f"http://127.0.0.1:5000/health_metrics?device_id={device_id}",
+            max_points=CHART_POINTS,
         )
-        data = response.json()
-
-        # Convert data to a DataFrame
-        df = pd.DataFrame(data)
         gb = df.groupby(by="metric_type")
 
         # Generate a graph for each health metric type
@@ -284,7 +320,6 @@ def update_health_metrics(n_clicks, device_id):
                 continue
 
             group = gb.get_group(metric_type)
-            group["timestamp"] = pd.to_datetime(group["timestamp"])
             unit = str(group["unit"].unique()[0]) if "unit" in group.columns else ""
 
             # Create line chart
@@ -341,13 +376,7 @@ def update_activity_tracking(n_clicks, device_id):
     ACTIVITY_TYPES = ["walking", "running", "cycling", "biking"]
 
     try:
-        response = requests.get(
-            f"http://127.0.0.1:5000/activity_tracking?device_id={device_id}"
-        )
-        data = response.json()
-
-        # Convert data to a DataFrame
-        df = pd.DataFrame(data)
+        df = fetch_frame(f"http://127.0.0.1:5000/activity_tracking?device_id={device_id}")
         gb = df.groupby(by="activity_type")
 
         # Generate a graph for each activity type
@@ -356,7 +385,6 @@ def update_activity_tracking(n_clicks, device_id):
                 continue
 
             group = gb.get_group(activity_type)
-            group["timestamp"] = pd.to_datetime(group["timestamp"])
             unit = str(group["unit"].unique()[0]) if "unit" in group.columns else ""
 
             # Create bar chart
@@ -410,13 +438,7 @@ def update_environmental_data(n_clicks, device_id):
     DATA_TYPES = ["temperature", "humidity"]
 
     try:
-        response = requests.get(
-            f"http://127.0.0.1:5000/environmental_data?device_id={device_id}"
-        )
-        data = response.json()
-
-        # Convert data to a DataFrame
-        df = pd.DataFrame(data)
+        df = fetch_frame(f"http://127.0.0.1:5000/environmental_data?device_id={device_id}")
         gb = df.groupby(by="data_type")
 
         # Generate a graph for each environmental data type
@@ -425,14 +447,12 @@ def update_environmental_data(n_clicks, device_id):
                 continue
 
             group = gb.get_group(data_type)
-            group["timestamp"] = pd.to_datetime(group["timestamp"])
 
+            group["value"] = group["value_num"]
             unit = ""
             if data_type == "temperature":
-                group["value"] = group["value"].str.replace('°C', '').astype(float)
                 unit = "°C"
             elif data_type == "humidity":
-                group["value"] = group["value"].str.replace('%', '').astype(float)
                 unit = "%"
 
             # Create line chart
@@ -482,7 +502,7 @@ def update_stress_levels(state):
         return {}
     try:
         response = requests.get(
-            f"http://127.0.0.1:5000/stress_levels?state={state}"
+            f"http://127.0.0.1:5000/stress_levels?state={state}&max_points={CHART_POINTS}"
         )
         data = response.json()
         df = pd.DataFrame(data)
@@ -524,6 +544,7 @@ def update_single_user_heart_rate(device_id, selected_date):
     try:
         response = requests.get(
             f"http://127.0.0.1:5000/heart_rate?device_id={device_id}&date={selected_date}"
+            f"&max_points={CHART_POINTS}"
         )
         data = response.json()
         df = pd.DataFrame(data)
@@ -565,22 +586,16 @@ def update_correlation_graph(device_id):
         ff=f"http://127.0.0.1:5000/health_metrics?device_id={device_id}&metric_type=heart_rate"
         print("DDS-------------")
         print(ff)
-        response_hr = requests.get(
+        df_hr = fetch_frame(
             f"http://127.0.0.1:5000/health_metrics?device_id={device_id}&metric_type=heart_rate"
         )
-        response_sl = requests.get(
+        df_sl = fetch_frame(
             f"http://127.0.0.1:5000/health_metrics?device_id={device_id}&metric_type=stress_level"
         )
-        data_hr = response_hr.json()
-        data_sl = response_sl.json()
 
         # Merge data on timestamp
-        df_hr = pd.DataFrame(data_hr)
-        df_sl = pd.DataFrame(data_sl)
         print(df_hr)
         print(df_sl)
-        df_hr["timestamp"] = pd.to_datetime(df_hr["timestamp"])
-        df_sl["timestamp"] = pd.to_datetime(df_sl["timestamp"])
 
         df = pd.merge(df_hr, df_sl, on="timestamp", suffixes=("_hr", "_sl"))
 
@@ -620,23 +635,10 @@ def update_correlation_graph(device_id):
 )
 def update_average_stress_level_state_graph(n):
     try:
-        # Fetch stress level data for all devices
-        response = requests.get("http://127.0.0.1:5000/health_metrics?metric_type=stress_level")
-        data = response.json()
-        df = pd.DataFrame(data)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-
-        # Fetch device locations to get states
-        response_locations = requests.get("http://127.0.0.1:5000/environmental_data?data_type=location")
-        location_data = response_locations.json()
-        df_locations = pd.DataFrame(location_data)
-        df_locations = df_locations[["device_id", "state"]].drop_duplicates()
-
-        # Merge data to get state information
-        df_merged = pd.merge(df, df_locations, on="device_id")
-
-        # Calculate average stress level per state
-        df_grouped = df_merged.groupby("state")["value"].mean().reset_index()
+        # Average stress level per state, computed by the API
+        df_grouped = fetch_aggregate(
+            table="health_metrics", metric_type="stress_level", group_by="state", agg="mean"
+        ).rename(columns={"mean": "value"})
 
         # Create bar chart
         fig = px.bar(
@@ -671,19 +673,13 @@ def update_average_stress_level_state_graph(n):
 )
 def update_activity_distribution_graph(n):
     try:
-        # Fetch activity tracking data
-        response = requests.get("http://127.0.0.1:5000/activity_tracking")
-        data = response.json()
-        
-        if len(data) == 0:
-            return
-        
-        
-        df = pd.DataFrame(data)
+        # Count activities per type, computed by the API
+        activity_counts = fetch_aggregate(
+            table="activity_tracking", group_by="activity_type", agg="count"
+        )
 
-        # Count activities
-        activity_counts = df["activity_type"].value_counts().reset_index()
-        activity_counts.columns = ["activity_type", "count"]
+        if activity_counts.empty:
+            return
 
         # Create pie chart
         fig = px.pie(
@@ -712,21 +708,15 @@ def update_activity_distribution_graph(n):
 )
 def update_stress_level_heatmap(n):
     try:
-        # Fetch stress level data
-        response = requests.get("http://127.0.0.1:5000/health_metrics?metric_type=stress_level")
-        data = response.json()
-        df = pd.DataFrame(data)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        df["hour"] = df["timestamp"].dt.hour
-
-        # Pivot the data
-        heatmap_data = df.pivot_table(
-            index="device_id",
-            columns="hour",
-            values="value",
-            aggfunc='mean'
+        # Average stress level per device and hour of day, computed by the API
+        df = fetch_aggregate(
+            table="health_metrics", metric_type="stress_level",
+            group_by="device_id,hour", agg="mean",
         )
 
+        # Pivot the grid
+        heatmap_data = df.pivot(index="device_id", columns="hour", values="mean")
+
         # Create heatmap
         fig = px.imshow(
             heatmap_data,
@@ -758,23 +748,17 @@ def update_temp_hr_graph(device_id):
         return {}
     try:
         # Fetch heart rate data
-        response_hr = requests.get(
+        df_hr = fetch_frame(
             f"http://127.0.0.1:5000/health_metrics?device_id={device_id}&metric_type=heart_rate"
         )
-        data_hr = response_hr.json()
-        df_hr = pd.DataFrame(data_hr)
-        df_hr["timestamp"] = pd.to_datetime(df_hr["timestamp"])
         df_hr["heart_rate"] = df_hr["value"]
         df_hr = df_hr[["timestamp", "heart_rate"]]
 
         # Fetch temperature data
-        response_temp = requests.get(
+        df_temp = fetch_frame(
             f"http://127.0.0.1:5000/environmental_data?device_id={device_id}&data_type=temperature"
         )
-        data_temp = response_temp.json()
-        df_temp = pd.DataFrame(data_temp)
-        df_temp["timestamp"] = pd.to_datetime(df_temp["timestamp"])
-        df_temp["temperature"] = df_temp["value"].str.replace('°C', '').astype(float)
+        df_temp["temperature"] = df_temp["value_num"]
         df_temp = df_temp[["timestamp", "temperature"]]
 
         # Merge data
@@ -818,16 +802,9 @@ def update_temp_hr_graph(device_id):
 def update_device_location_map(n):
     try:
         # Fetch location data
-        response = requests.get("http://127.0.0.1:5000/environmental_data?data_type=location")
-        data = response.json()
-        df = pd.DataFrame(data)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        df = fetch_frame("http://127.0.0.1:5000/environmental_data?data_type=location")
         df = df.sort_values("timestamp").drop_duplicates(subset="device_id", keep="last")
 
-        # Extract latitude and longitude
-        df["latitude"] = df["value"].str.split(", ").str[0].astype(float)
-        df["longitude"] = df["value"].str.split(", ").str[1].astype(float)
-
         # Create map
         fig = px.scatter_mapbox(
             df,
@@ -863,9 +840,7 @@ def update_hr_histogram(device_id):
             url = f"http://127.0.0.1:5000/health_metrics?metric_type=heart_rate&device_id={device_id}"
         else:
             url = "http://127.0.0.1:5000/health_metrics?metric_type=heart_rate"
-        response = requests.get(url)
-        data = response.json()
-        df = pd.DataFrame(data)
+        df = fetch_frame(url)
         df["value"] = df["value"].astype(float)
 
         # Create histogram
@@ -1,263 +1,159 @@
+import argparse
 import random
-import time
-from datetime import datetime, timedelta
-from faker import Faker
-import json
-import pandas as pd
-from cassandra.cluster import Cluster
-from kafka import KafkaProducer
-from cassandra_kafka_setup import TOPIC_NAME
-
-# Constants for Kafka
-BOOTSTRAP_SERVERS = "localhost:9092"
-# TOPIC_NAME = "apple-watch-iot-2"
-
-fake = Faker()
-
-# Define states and towns
-STATES = {
-    "Arizona": ["Tempe", "Phoenix", "Scottsdale"],
-    "California": ["Los Angeles", "San Francisco", "San Diego"],
-    "Texas": ["Austin", "Dallas", "Houston"],
-    "New York": ["New York City", "Buffalo", "Rochester"],
-}
-
-# Assign a town and state to each device ID
-DEVICE_LOCATIONS = {}
-device_ids = [f"device_{i:03}" for i in range(1, 21)]  # 20 unique device IDs
-states_and_towns = []
-
-# Flatten the STATES dictionary into a list of (state, town) tuples
-for state, towns in STATES.items():
-    for town in towns:
-        states_and_towns.append((state, town))
-
-# Assign each device to a random state and town
-for device_id in device_ids:
-    state, town = random.choice(states_and_towns)
-    # Assign approximate lat/lon for each town
-    town_coords = {
-        "Tempe": (33.4255, -111.9400),
-        "Phoenix": (33.4484, -112.0740),
-        "Scottsdale": (33.4942, -111.9261),
-        "Los Angeles": (34.0522, -118.2437),
-        "San Francisco": (37.7749, -122.4194),
-        "San Diego": (32.7157, -117.1611),
-        "Austin": (30.2672, -97.7431),
-        "Dallas": (32.7767, -96.7970),
-        "Houston": (29.7604, -95.3698),
-        "New York City": (40.7128, -74.0060),
-        "Buffalo": (42.8864, -78.8784),
-        "Rochester": (43.1566, -77.6088),
-    }
-    latitude, longitude = town_coords.get(town, (fake.latitude(), fake.longitude()))
-    DEVICE_LOCATIONS[device_id] = {
-        "state": state,
-        "town": town,
-        "latitude": latitude,
-        "longitude": longitude,
-    }
-
-# Define activities and related metrics
-ACTIVITY_DATA = {
-    "biking": {"calories_per_min": 7, "heart_rate": (120, 160), "stress_level": 5},
-    "walking": {"calories_per_min": 4, "heart_rate": (80, 110), "stress_level": 2},
-    "running": {"calories_per_min": 10, "heart_rate": (140, 180), "stress_level": 6},
-    "sleeping": {"calories_per_min": 1, "heart_rate": (50, 70), "stress_level": 1},
-    "working": {"calories_per_min": 2, "heart_rate": (60, 80), "stress_level": 7},
-}
-
-# Generate weather for a specific town (relatively stable)
-def generate_weather(town):
-    random.seed(town)  # Ensure consistent weather per town
-    return {
-        "temperature": f"{random.uniform(20, 30):.1f}°C",
-        "humidity": f"{random.uniform(40, 60):.1f}%",
-    }
-
-def generate_data_for_device(device_id):
-    device_location = DEVICE_LOCATIONS[device_id]
-    town = device_location["town"]
-    state = device_location["state"]
-    latitude = device_location["latitude"]
-    longitude = device_location["longitude"]
-
-    data = []
-    base_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    for i in range(5):  # Generate 5 entries per device
-        current_time = base_time + timedelta(hours=random.randint(0, 23), minutes=random.randint(0, 59))
-
-        activity = random.choice(list(ACTIVITY_DATA.keys()))
-        activity_data = ACTIVITY_DATA[activity]
-        heart_rate = random.randint(*activity_data["heart_rate"])
-        duration = random.randint(10, 60)  # Duration between 10 to 60 minutes
-        calories_burned = activity_data["calories_per_min"] * duration
-        stress_level = activity_data["stress_level"]
-
-        # Add health metrics
-        data.append(
-            {
-                "device_id": device_id,
-                "timestamp": current_time.isoformat(),
-                "metric_type": "heart_rate",
-                "value": heart_rate,
-                "unit": "bpm",
-            }
-        )
-        data.append(
-            {
-                "device_id": device_id,
-                "timestamp": current_time.isoformat(),
-                "metric_type": "calories_burned",
-                "value": calories_burned,
-                "unit": "kcal",
-            }
-        )
-        data.append(
-            {
-                "device_id": device_id,
-                "timestamp": current_time.isoformat(),
-                "metric_type": "stress_level",
-                "value": stress_level,
-                "unit": "level",
-            }
-        )
-
-        # Add location data
-        data.append(
-            {
-                "device_id": device_id,
-                "timestamp": current_time.isoformat(),
-                "data_type": "location",
-                "value": f"{latitude:.6f}, {longitude:.6f}",
-                "town": town,
-                "state": state,
-            }
-        )
-
-        # Add weather data
-        weather = generate_weather(town)
-        data.append(
-            {
-                "device_id": device_id,
-                "timestamp": current_time.isoformat(),
-                "data_type": "temperature",
-                "value": weather["temperature"],
-            }
-        )
-        data.append(
-            {
-                "device_id": device_id,
-                "timestamp": current_time.isoformat(),
-                "data_type": "humidity",
-                "value": weather["humidity"],
-            }
-        )
-    return data
-
-# Kafka Producer setup
-def setup_kafka_producer():
-    return KafkaProducer(
-        bootstrap_servers=[BOOTSTRAP_SERVERS],
-        value_serializer=lambda x: json.dumps(x).encode("utf-8"),
-    )
-
-# Cassandra session setup
-def setup_cassandra_session():
-    cluster = Cluster(["127.0.0.1"])
-    session = cluster.connect()
-    session.set_keyspace("apple_watch_iot")
-    return session
-
-# Insert data into Cassandra
-def send_to_cassandra(session, table, data):
-    if table == "health_metrics":
-        query = f"""
-        INSERT INTO {table} (device_id, timestamp, metric_type, value, unit) 
-        VALUES (%s, %s, %s, %s, %s);
-        """
-        session.execute(query, (data["device_id"], data["timestamp"], data["metric_type"], data["value"], data["unit"]))
-    elif table == "environmental_data":
-        query = f"""
-        INSERT INTO environmental_data (device_id, timestamp, data_type, value, town, state) 
-        VALUES (%s, %s, %s, %s, %s, %s);
-        """
-        session.execute(query, (data["device_id"], data["timestamp"], data["data_type"], data["value"], data.get("town", ""), data.get("state", "")))
-    else:
-        print(f"Unknown table: {table}")
-    print(f"Inserted into Cassandra ({table}): {data}")
-
-# Send data to Kafka
-def send_to_kafka(producer, data):
-    producer.send(TOPIC_NAME, value=data)
-    print(f"Sent to Kafka: {data}")
-    time.sleep(0.01)  # Reduced delay for faster data generation
-
-# Write data to CSV
-def write_to_csv(data_list, table_name):
-    """Write data to a CSV file for the specified table."""
-    filename = f"{table_name}.csv"
-    df = pd.DataFrame(data_list)
-    df.to_csv(filename, index=False)
-    print(f"Data for table '{table_name}' written to CSV file: {filename}")
-
-
-def generate_and_insert_activity_data(session):
+from datetime import date, timedelta
+from cassandra_writer import CassandraWriteEngine
+from kafka_throughput import DeliveryTracker
+from parquet_sink import PARQUET_DIR, ParquetStreamSink
+from stream_sinks import (
+    record_table,
+    send_to_kafka,
+    setup_cassandra_session,
+    setup_kafka_producer,
+)
+from device_fleet import (
+    ACTIVITY_DATA,
+    DEVICE_LOCATIONS,
+    assign_device_locations,
+    device_ids,
+)
+from rng_streams import ACTIVITY_STREAM, device_random
+from partitioners import make_partitioner
+from vectorized_generator import day_start, generate_fleet_readings, iter_records
+
+# Constants for the Cassandra write engine
+CASSANDRA_CONCURRENCY = 64  # Max requests in flight
+CASSANDRA_BATCH_SIZE = 1000  # Rows buffered before a flush
+
+
+def generate_activity_data(seed=None, base_time=None):
     """
-    Generate and insert activity data into the activity_tracking table for devices 1 to 20.
+    Generate activity_tracking records for devices 1 to 20, within the 24
+    hours before the end of `base_time`'s day (today by default). With a
+    master seed each device draws from its own activity stream.
     """
+    end_time = (base_time or day_start()) + timedelta(days=1)
+    data = []
     for device_id in device_ids:
+        rng = random if seed is None else device_random(seed, device_id, ACTIVITY_STREAM)
         for _ in range(5):  # Generate 5 activity records per device
             # Randomly select an activity
-            activity = random.choice(list(ACTIVITY_DATA.keys()))
+            activity = rng.choice(list(ACTIVITY_DATA.keys()))
             activity_data = ACTIVITY_DATA[activity]
 
             # Generate random values
-            duration = random.randint(10, 60)  # Duration in minutes
+            duration = rng.randint(10, 60)  # Duration in minutes
             value = duration * activity_data["calories_per_min"]  # Calories burned
             unit = "calories"
 
             # Generate timestamp
-            current_time = datetime.now() - timedelta(
-                minutes=random.randint(0, 1440)  # Within the last 24 hours
+            current_time = end_time - timedelta(
+                minutes=rng.randint(0, 1440)  # Within the last 24 hours
+            )
+
+            data.append(
+                {
+                    "device_id": device_id,
+                    "timestamp": current_time.isoformat(),
+                    "activity_type": activity,
+                    "value": value,
+                    "unit": unit,
+                }
             )
+    return data
 
-            # Insert into the activity_tracking table
-            query = """
-                INSERT INTO activity_tracking (device_id, timestamp, activity_type, value, unit)
-                VALUES (%s, %s, %s, %s, %s);
-            """
-            session.execute(query, (device_id, current_time, activity, value, unit))
-            print(f"Inserted activity data for {device_id}: {activity}, {value} {unit}, {current_time}")
 
 # Main function
 if __name__ == "__main__":
-    producer = setup_kafka_producer()
-    session = setup_cassandra_session()
+    parser = argparse.ArgumentParser(description="Stream mock Apple Watch IoT data")
+    parser.add_argument(
+        "--throughput",
+        action="store_true",
+        help="Batch and compress Kafka sends and track deliveries asynchronously",
+    )
+    parser.add_argument(
+        "--wire-format",
+        choices=["json", "binary"],
+        default="json",
+        help="Kafka message encoding (see wire_format.py)",
+    )
+    parser.add_argument(
+        "--partitioner",
+        choices=["hash", "range"],
+        default="hash",
+        help="How device_id keys are mapped to Kafka partitions",
+    )
+    parser.add_argument(
+        "--parquet-dir",
+        default=PARQUET_DIR,
+        help="Directory the generated readings are streamed to as Parquet",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Master seed for reproducible per-device random streams",
+    )
+    parser.add_argument(
+        "--base-date",
+        type=date.fromisoformat,
+        default=None,
+        help="Day (YYYY-MM-DD) the readings fall on, today by default; "
+        "fix it together with --seed to repeat a run",
+    )
+    parser.add_argument(
+        "--direct-cassandra",
+        action="store_true",
+        help="Also write to Cassandra directly instead of only through "
+        "Kafka and ingest_service.py",
+    )
+    args = parser.parse_args()
+    if args.seed is not None:
+        DEVICE_LOCATIONS.update(assign_device_locations(device_ids, seed=args.seed))
+    partitioner = make_partitioner(args.partitioner, num_devices=len(device_ids))
+
+    producer = setup_kafka_producer(
+        throughput=args.throughput, wire_format=args.wire_format
+    )
+    tracker = DeliveryTracker() if args.throughput else None
+    # Kafka is the buffer in front of Cassandra: ingest_service.py consumes
+    # the topic and writes the tables
+    writer = None
+    if args.direct_cassandra:
+        writer = CassandraWriteEngine(
+            setup_cassandra_session(),
+            concurrency=CASSANDRA_CONCURRENCY,
+            batch_size=CASSANDRA_BATCH_SIZE,
+        )
+
+    sink = ParquetStreamSink(args.parquet_dir)
 
-    health_metrics_data = []
-    location_data = []
-    for device_id in DEVICE_LOCATIONS.keys():
-        generate_and_insert_activity_data(session)
+    def publish(entry):
+        table = record_table(entry)
+        if writer is not None:
+            writer.add(table, entry)
+        sink.write(table, entry)
 
-    for device_id in DEVICE_LOCATIONS.keys():
-        device_data = generate_data_for_device(device_id)
-        for entry in device_data:
-            if entry.get("metric_type") in ["heart_rate", "calories_burned", "stress_level"]:
-                health_metrics_data.append(entry)
-                send_to_cassandra(session, "health_metrics", entry)
-            elif entry.get("data_type") == "location":
-                location_data.append(entry)
-                send_to_cassandra(session, "environmental_data", entry)
-            else:
-                # For other environmental data like temperature and humidity
-                send_to_cassandra(session, "environmental_data", entry)
+        # Send all entries to Kafka
+        send_to_kafka(producer, entry, tracker, partitioner)
+
+    base_time = day_start(args.base_date)
+    for entry in generate_activity_data(args.seed, base_time):
+        publish(entry)
+
+    # Readings are generated as columns and only turned into dicts here
+    readings = generate_fleet_readings(
+        list(DEVICE_LOCATIONS.keys()), ticks=5, base_time=base_time, seed=args.seed
+    )
+    for entry in iter_records(readings):
+        publish(entry)
 
-            # Send all entries to Kafka
-            send_to_kafka(producer, entry)
+    if writer is not None:
+        writer.flush()
+        writer.report()
 
-    # Optionally, write to CSV
-    write_to_csv(health_metrics_data, "health_metrics")
-    write_to_csv(location_data, "environmental_data")
+    sink.close()
 
-    producer.close()
\ No newline at end of file
+    producer.flush()
+    producer.close()
+    if tracker is not None:
+        tracker.summary()
\ No newline at end of file
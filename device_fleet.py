@@ -0,0 +1,170 @@
+import random
+from datetime import datetime, timedelta
+from faker import Faker
+from rng_streams import LOCATION_STREAM, device_random
+
+fake = Faker()
+
+# Define states and towns
+STATES = {
+    "Arizona": ["Tempe", "Phoenix", "Scottsdale"],
+    "California": ["Los Angeles", "San Francisco", "San Diego"],
+    "Texas": ["Austin", "Dallas", "Houston"],
+    "New York": ["New York City", "Buffalo", "Rochester"],
+}
+
+# Approximate lat/lon for each town
+TOWN_COORDS = {
+    "Tempe": (33.4255, -111.9400),
+    "Phoenix": (33.4484, -112.0740),
+    "Scottsdale": (33.4942, -111.9261),
+    "Los Angeles": (34.0522, -118.2437),
+    "San Francisco": (37.7749, -122.4194),
+    "San Diego": (32.7157, -117.1611),
+    "Austin": (30.2672, -97.7431),
+    "Dallas": (32.7767, -96.7970),
+    "Houston": (29.7604, -95.3698),
+    "New York City": (40.7128, -74.0060),
+    "Buffalo": (42.8864, -78.8784),
+    "Rochester": (43.1566, -77.6088),
+}
+
+# Flatten the STATES dictionary into a list of (state, town) tuples
+states_and_towns = []
+for state, towns in STATES.items():
+    for town in towns:
+        states_and_towns.append((state, town))
+
+
+def assign_device_location(device_id, rng=random):
+    """Assign a device to a random state and town."""
+    state, town = rng.choice(states_and_towns)
+    latitude, longitude = TOWN_COORDS.get(town, (fake.latitude(), fake.longitude()))
+    return {
+        "state": state,
+        "town": town,
+        "latitude": latitude,
+        "longitude": longitude,
+    }
+
+
+def assign_device_locations(device_ids, seed=None):
+    # With a master seed every device draws from its own stream, so the
+    # mapping doesn't depend on which other devices are assigned with it
+    if seed is None:
+        return {device_id: assign_device_location(device_id) for device_id in device_ids}
+    return {
+        device_id: assign_device_location(
+            device_id, device_random(seed, device_id, LOCATION_STREAM)
+        )
+        for device_id in device_ids
+    }
+
+
+# Assign a town and state to each device ID
+device_ids = [f"device_{i:03}" for i in range(1, 21)]  # 20 unique device IDs
+DEVICE_LOCATIONS = assign_device_locations(device_ids)
+
+# Define activities and related metrics
+ACTIVITY_DATA = {
+    "biking": {"calories_per_min": 7, "heart_rate": (120, 160), "stress_level": 5},
+    "walking": {"calories_per_min": 4, "heart_rate": (80, 110), "stress_level": 2},
+    "running": {"calories_per_min": 10, "heart_rate": (140, 180), "stress_level": 6},
+    "sleeping": {"calories_per_min": 1, "heart_rate": (50, 70), "stress_level": 1},
+    "working": {"calories_per_min": 2, "heart_rate": (60, 80), "stress_level": 7},
+}
+
+
+# Weather for a specific town (relatively stable). Seeded by the town name
+# on a private generator so the global RNG is left alone.
+def town_weather(town):
+    rng = random.Random(town)
+    return rng.uniform(20, 30), rng.uniform(40, 60)
+
+
+def generate_weather(town):
+    temperature, humidity = town_weather(town)
+    return {
+        "temperature": f"{temperature:.1f}°C",
+        "humidity": f"{humidity:.1f}%",
+    }
+
+def generate_data_for_device(device_id, rng=random):
+    device_location = DEVICE_LOCATIONS[device_id]
+    town = device_location["town"]
+    state = device_location["state"]
+    latitude = device_location["latitude"]
+    longitude = device_location["longitude"]
+
+    data = []
+    base_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for i in range(5):  # Generate 5 entries per device
+        current_time = base_time + timedelta(hours=rng.randint(0, 23), minutes=rng.randint(0, 59))
+
+        activity = rng.choice(list(ACTIVITY_DATA.keys()))
+        activity_data = ACTIVITY_DATA[activity]
+        heart_rate = rng.randint(*activity_data["heart_rate"])
+        duration = rng.randint(10, 60)  # Duration between 10 to 60 minutes
+        calories_burned = activity_data["calories_per_min"] * duration
+        stress_level = activity_data["stress_level"]
+
+        # Add health metrics
+        data.append(
+            {
+                "device_id": device_id,
+                "timestamp": current_time.isoformat(),
+                "metric_type": "heart_rate",
+                "value": heart_rate,
+                "unit": "bpm",
+            }
+        )
+        data.append(
+            {
+                "device_id": device_id,
+                "timestamp": current_time.isoformat(),
+                "metric_type": "calories_burned",
+                "value": calories_burned,
+                "unit": "kcal",
+            }
+        )
+        data.append(
+            {
+                "device_id": device_id,
+                "timestamp": current_time.isoformat(),
+                "metric_type": "stress_level",
+                "value": stress_level,
+                "unit": "level",
+            }
+        )
+
+        # Add location data
+        data.append(
+            {
+                "device_id": device_id,
+                "timestamp": current_time.isoformat(),
+                "data_type": "location",
+                "value": f"{latitude:.6f}, {longitude:.6f}",
+                "town": town,
+                "state": state,
+            }
+        )
+
+        # Add weather data
+        weather = generate_weather(town)
+        data.append(
+            {
+                "device_id": device_id,
+                "timestamp": current_time.isoformat(),
+                "data_type": "temperature",
+                "value": weather["temperature"],
+            }
+        )
+        data.append(
+            {
+                "device_id": device_id,
+                "timestamp": current_time.isoformat(),
+                "data_type": "humidity",
+                "value": weather["humidity"],
+            }
+        )
+    return data
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from query_planner import QueryRejected
+
+MIN_POINTS = 3  # LTTB always keeps the first and last point
+
+
+def parse_max_points(max_points):
+    try:
+        points = int(max_points)
+    except ValueError:
+        points = 0
+    if points < MIN_POINTS:
+        raise QueryRejected(f"max_points must be an integer of at least {MIN_POINTS}")
+    return points
+
+
+def lttb_indices(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets: indices of at most `max_points` points of
+    the series (x ascending) that keep its visual shape. The first and last
+    points are kept; from each bucket in between, the point forming the
+    largest triangle with the previous pick and the next bucket's mean.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    every = (n - 2) / (max_points - 2)
+    edges = (np.arange(max_points - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    picked = np.empty(max_points, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x = x[end:next_end].mean()
+        mean_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - mean_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (mean_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def downsample(rows, max_points, series=(), time_field="timestamp", value_field="value"):
+    """
+    LTTB-downsample each series of `rows` (one per distinct value of the
+    `series` fields) to at most `max_points` points. Rows without a value are
+    dropped. The kept rows come back in their original order.
+    """
+    if not rows:
+        return rows
+    frame = pd.DataFrame({
+        "x": pd.to_datetime([getattr(row, time_field) for row in rows]).asi8,
+        "y": pd.to_numeric([getattr(row, value_field) for row in rows], errors="coerce"),
+    })
+    for field in series:
+        frame[field] = [getattr(row, field, None) for row in rows]
+    frame = frame[frame["y"].notna()]
+    groups = frame.groupby(list(series), sort=False, dropna=False).indices if series else {None: np.arange(len(frame))}
+
+    x = frame["x"].to_numpy(dtype=np.float64)
+    y = frame["y"].to_numpy(dtype=np.float64)
+    positions = frame.index.to_numpy()
+    kept = []
+    for members in groups.values():
+        members = members[np.argsort(x[members], kind="stable")]
+        # Relative times keep the triangle areas precise
+        picked = lttb_indices(x[members] - x[members[0]], y[members], max_points)
+        kept.append(positions[members[picked]])
+    if not kept:
+        return []
+    return [rows[i] for i in np.sort(np.concatenate(kept))]
@@ -0,0 +1,201 @@
+import argparse
+import multiprocessing
+import os
+import time
+from datetime import date
+
+from cassandra_writer import CassandraWriteEngine
+from device_fleet import assign_device_locations
+from kafka_throughput import DeliveryTracker
+from partitioners import make_partitioner
+from stream_sinks import (
+    record_table,
+    send_to_kafka,
+    setup_cassandra_session,
+    setup_kafka_producer,
+)
+from vectorized_generator import day_start, generate_fleet_readings, iter_records
+
+# Events taken from the token bucket at a time
+PACING_CHUNK = 100
+
+
+class TokenBucket:
+    """
+    Token bucket pacing `rate` events per second with bursts of up to
+    `capacity` events. Acquiring more tokens than are available puts the
+    bucket into debt and sleeps until it is paid back.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate * 0.1, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def acquire(self, n=1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= n
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+def shard_devices(device_ids, num_workers):
+    """Split device IDs into contiguous, nearly equal shards."""
+    shards = []
+    size, extra = divmod(len(device_ids), num_workers)
+    start = 0
+    for worker in range(num_workers):
+        end = start + size + (1 if worker < extra else 0)
+        shards.append(device_ids[start:end])
+        start = end
+    return [shard for shard in shards if shard]
+
+
+def run_worker(worker_id, device_locations, target_rate, duration, use_cassandra,
+               seed, wire_format, partitioner_name, num_devices, base_time):
+    """
+    Simulate one shard of the fleet: every round generates one tick for each
+    device in the shard and sends the readings at `target_rate` events/sec.
+    Round N draws tick N of each device's own stream, so the readings don't
+    depend on how the fleet was sharded.
+    """
+    shard_ids = list(device_locations.keys())
+    bucket = TokenBucket(target_rate)
+
+    producer = setup_kafka_producer(throughput=True, wire_format=wire_format)
+    tracker = DeliveryTracker()
+    partitioner = make_partitioner(partitioner_name, num_devices)
+    writer = None
+    if use_cassandra:
+        writer = CassandraWriteEngine(setup_cassandra_session())
+
+    events = 0
+    tick = 0
+    start = time.monotonic()
+    deadline = start + duration
+    while time.monotonic() < deadline:
+        readings = generate_fleet_readings(
+            shard_ids, ticks=1, device_locations=device_locations,
+            base_time=base_time, seed=seed, tick_offset=tick,
+        )
+        tick += 1
+        for entry in iter_records(readings):
+            if events % PACING_CHUNK == 0:
+                bucket.acquire(PACING_CHUNK)
+                if time.monotonic() >= deadline:
+                    break
+            send_to_kafka(producer, entry, tracker, partitioner)
+            if writer is not None:
+                writer.add(record_table(entry), entry)
+            events += 1
+    elapsed = time.monotonic() - start
+
+    producer.flush()
+    producer.close()
+    result = {
+        "worker": worker_id,
+        "devices": len(shard_ids),
+        "events": events,
+        "elapsed": elapsed,
+        "target_rate": target_rate,
+        "achieved_rate": events / elapsed if elapsed else 0.0,
+        "kafka": tracker.stats(),
+    }
+    if writer is not None:
+        writer.flush()
+        result["cassandra"] = writer.stats()
+    return result
+
+
+def report(results, target_rate):
+    print(f"{'worker':>6} {'devices':>8} {'events':>10} {'target/s':>10} "
+          f"{'achieved/s':>11} {'ratio':>6} {'kafka failed':>13}")
+    for r in results:
+        ratio = r["achieved_rate"] / r["target_rate"] if r["target_rate"] else 0.0
+        print(f"{r['worker']:>6} {r['devices']:>8} {r['events']:>10} "
+              f"{r['target_rate']:>10.0f} {r['achieved_rate']:>11.0f} "
+              f"{ratio:>6.2f} {r['kafka']['failed']:>13}")
+    achieved = sum(r["achieved_rate"] for r in results)
+    print(f"Total: {sum(r['events'] for r in results)} events, "
+          f"target {target_rate:.0f}/s, achieved {achieved:.0f}/s "
+          f"({achieved / target_rate:.0%} of target)")
+
+
+def simulate_fleet(num_devices, num_workers, target_rate, duration,
+                   use_cassandra=False, seed=0, wire_format="json",
+                   partitioner="hash", base_date=None):
+    if num_devices < 1 or num_workers < 1:
+        raise ValueError("num_devices and num_workers must be at least 1")
+    if target_rate <= 0:
+        raise ValueError("target_rate must be positive")
+    device_ids = [f"device_{i:06}" for i in range(1, num_devices + 1)]
+    # Locations and the day are fixed once in the parent so every run of a
+    # shard keeps the same device -> town mapping and timestamps
+    device_locations = assign_device_locations(device_ids, seed=seed)
+    base_time = day_start(base_date)
+
+    shards = shard_devices(device_ids, num_workers)
+    jobs = []
+    for worker_id, shard in enumerate(shards):
+        # Each worker gets a share of the global rate proportional to its devices
+        worker_rate = target_rate * len(shard) / num_devices
+        jobs.append((
+            worker_id,
+            {device_id: device_locations[device_id] for device_id in shard},
+            worker_rate,
+            duration,
+            use_cassandra,
+            seed,
+            wire_format,
+            partitioner,
+            num_devices,
+            base_time,
+        ))
+
+    # Cassandra and Kafka clients start background threads, so workers are
+    # spawned rather than forked
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(len(jobs)) as pool:
+        results = pool.starmap(run_worker, jobs)
+
+    report(results, target_rate)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet of Apple Watches")
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rate", type=float, default=10_000,
+                        help="Global target in events per second")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--direct-cassandra", action="store_true",
+                        help="Also write to Cassandra directly, not only via Kafka")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Master seed for every device's random streams")
+    parser.add_argument("--wire-format", choices=["json", "binary"], default="json")
+    parser.add_argument("--partitioner", choices=["hash", "range"], default="hash")
+    parser.add_argument("--base-date", type=date.fromisoformat, default=None,
+                        help="Day (YYYY-MM-DD) the readings fall on, today by default")
+    args = parser.parse_args()
+    if args.devices < 1:
+        parser.error("--devices must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    simulate_fleet(
+        args.devices,
+        args.workers,
+        args.rate,
+        args.duration,
+        use_cassandra=args.direct_cassandra,
+        seed=args.seed,
+        wire_format=args.wire_format,
+        partitioner=args.partitioner,
+        base_date=args.base_date,
+    )
@@ -0,0 +1,362 @@
+import argparse
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from kafka import ConsumerRebalanceListener, TopicPartition
+from kafka.errors import CommitFailedError
+from kafka.structs import OffsetAndMetadata
+
+from cassandra_kafka_setup import NUM_PARTITIONS, TOPIC_NAME
+from cassandra_writer import CassandraWriteEngine, validate_record
+from ingest_service import (
+    BATCH_SIZE,
+    FLUSH_INTERVAL,
+    INGEST_GROUP_ID,
+    POLL_TIMEOUT_MS,
+    RETRY_BACKOFF,
+    setup_kafka_consumer,
+)
+from response_cache import SHARED_CACHE_PATH, ChangeNotifier, Generations
+from stream_sinks import record_table, setup_cassandra_session
+from wire_format import decode_message
+
+# Sizes of the in-memory pipeline inside each worker
+QUEUE_SIZE = 20_000  # Messages buffered between the poll loop and the decoder
+DECODED_QUEUE_SIZE = 5_000  # Decoded rows buffered ahead of the writer
+MAX_POLL_RECORDS = 1_000  # Upper bound on one poll, headroom kept in QUEUE_SIZE
+RESUME_FRACTION = 0.25  # Resume paused partitions once the queue is this empty
+
+# Tells the pipeline threads to exit
+STOP = object()
+
+
+def offset_metadata(offset):
+    """OffsetAndMetadata for `offset` (kafka-python 2.x has no leader_epoch)."""
+    if "leader_epoch" in OffsetAndMetadata._fields:
+        return OffsetAndMetadata(offset, "", -1)
+    return OffsetAndMetadata(offset, "")
+
+
+class IngestPipeline(ConsumerRebalanceListener):
+    """
+    Ingest pipeline for one member of the consumer group.
+
+    The main thread only polls Kafka and commits offsets; a decoder thread
+    turns raw messages into rows and a writer thread writes them in
+    micro-batches through the write engine. The threads are joined by
+    bounded queues. When the raw queue is nearly full the assigned partitions
+    are paused, so the consumer keeps its group membership without fetching
+    more, and they are resumed once the queue has drained.
+
+    The writer reports the offsets of each batch Cassandra acknowledged and
+    only those are committed. Before partitions are revoked in a rebalance
+    the pipeline is drained and committed, so the next owner picks up exactly
+    where this worker stopped.
+    """
+
+    def __init__(self, writer, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 queue_size=QUEUE_SIZE):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.consumer = None
+
+        self.raw_queue = queue.Queue(queue_size)
+        self.decoded_queue = queue.Queue(DECODED_QUEUE_SIZE)
+        self.done_queue = queue.Queue()
+        self.pause_at = max(queue_size - MAX_POLL_RECORDS, 1)
+        self.resume_at = int(queue_size * RESUME_FRACTION)
+        self.paused = False
+
+        self.consumed = 0
+        self.skipped = 0
+        self.pauses = 0
+        self.paused_time = 0.0
+        self.paused_since = None
+        self.rebalances = 0
+        # Set if the writer thread hit an error it can't retry
+        self.writer_error = None
+
+    # Pipeline threads
+
+    def decode_loop(self):
+        while True:
+            message = self.raw_queue.get()
+            if message is STOP or isinstance(message, threading.Event):
+                self.decoded_queue.put(message)
+                if message is STOP:
+                    return
+                continue
+            try:
+                data = decode_message(message.value)
+                table = record_table(data)
+                validate_record(table, data)
+            except Exception as e:
+                # A record we can't decode or bind will never succeed, skip it but
+                # still let its offset be committed
+                self.skipped += 1
+                print(f"Skipping undecodable record at {message.topic}/"
+                      f"{message.partition}@{message.offset}: {e}")
+                table = data = None
+            self.decoded_queue.put((message.topic, message.partition,
+                                    message.offset, table, data))
+
+    def write_loop(self):
+        rows = []
+        offsets = {}
+        batch_started = None
+        while True:
+            try:
+                item = self.decoded_queue.get(timeout=self.flush_interval / 4)
+            except queue.Empty:
+                item = None
+
+            marker = None
+            if item is STOP or isinstance(item, threading.Event):
+                marker = item
+            elif item is not None and self.writer_error is None:
+                topic, partition, offset, table, data = item
+                if data is not None:
+                    rows.append((table, data))
+                offsets[(topic, partition)] = offset + 1
+                if batch_started is None:
+                    batch_started = time.monotonic()
+
+            due = batch_started is not None and (
+                len(rows) >= self.batch_size
+                or time.monotonic() - batch_started >= self.flush_interval
+            )
+            if offsets and (due or marker is not None):
+                try:
+                    self.write_batch(rows)
+                except Exception as e:
+                    # Nothing from this batch on is committed; markers are
+                    # still set so drain() returns, and the poll loop stops
+                    # the worker so another member re-reads the partitions
+                    self.writer_error = e
+                    print(f"Writer failed, stopping this worker: {e!r}")
+                else:
+                    self.done_queue.put(offsets)
+                rows = []
+                offsets = {}
+                batch_started = None
+
+            if marker is STOP:
+                return
+            if marker is not None:
+                marker.set()
+
+    def write_batch(self, rows):
+        """Write `rows`, retrying the whole batch until Cassandra takes it."""
+        while True:
+            failed_before = self.writer.rows_failed
+            for table, data in rows:
+                self.writer.add(table, data)
+            self.writer.flush()
+            if self.writer.rows_failed == failed_before:
+                return
+            # Batches are upserts, so rewriting the rows that did succeed is safe
+            print(f"Batch had failed writes, retrying in {RETRY_BACKOFF:.0f}s")
+            time.sleep(RETRY_BACKOFF)
+
+    # Poll thread
+
+    def commit_done(self):
+        offsets = {}
+        while True:
+            try:
+                offsets.update(self.done_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not offsets:
+            return
+        try:
+            self.consumer.commit({
+                TopicPartition(topic, partition): offset_metadata(offset)
+                for (topic, partition), offset in offsets.items()
+            })
+        except CommitFailedError as e:
+            # The group rebalanced underneath us; the rows are written and the
+            # new owner re-reads them from the previous commit
+            print(f"Offset commit failed: {e}")
+
+    def drain(self):
+        """Write everything handed to the pipeline so far and commit it."""
+        marker = threading.Event()
+        self.raw_queue.put(marker)
+        marker.wait()
+        self.commit_done()
+
+    def apply_backpressure(self):
+        depth = self.raw_queue.qsize()
+        if not self.paused and depth >= self.pause_at:
+            self.consumer.pause(*self.consumer.assignment())
+            self.paused = True
+            self.pauses += 1
+            self.paused_since = time.monotonic()
+        elif self.paused and depth <= self.resume_at:
+            self.consumer.resume(*self.consumer.paused())
+            self.paused = False
+            self.paused_time += time.monotonic() - self.paused_since
+
+    def on_partitions_revoked(self, revoked):
+        if self.consumer is not None and revoked:
+            self.drain()
+
+    def on_partitions_assigned(self, assigned):
+        self.rebalances += 1
+        # Newly assigned partitions start unpaused
+        if self.paused:
+            self.paused = False
+            self.paused_time += time.monotonic() - self.paused_since
+        print(f"Assigned partitions: {sorted(tp.partition for tp in assigned)}")
+
+    def run(self, consumer, stop_event):
+        self.consumer = consumer
+        threads = [
+            threading.Thread(target=self.decode_loop, daemon=True),
+            threading.Thread(target=self.write_loop, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        start = time.monotonic()
+        try:
+            while not stop_event.is_set() and self.writer_error is None:
+                batches = consumer.poll(
+                    timeout_ms=POLL_TIMEOUT_MS, max_records=MAX_POLL_RECORDS
+                )
+                for messages in batches.values():
+                    for message in messages:
+                        # Never blocks: partitions are paused while fewer than
+                        # MAX_POLL_RECORDS slots are free
+                        self.raw_queue.put(message)
+                        self.consumed += 1
+                self.apply_backpressure()
+                self.commit_done()
+        finally:
+            self.drain()
+            self.raw_queue.put(STOP)
+            for thread in threads:
+                thread.join()
+            # Nothing is left to drain if closing the consumer revokes anything
+            self.consumer = None
+            consumer.close()
+        if self.paused:
+            self.paused_time += time.monotonic() - self.paused_since
+        return time.monotonic() - start
+
+
+def run_worker(worker_id, group_id, batch_size, flush_interval, concurrency,
+               stop_event, results):
+    """Run one member of the consumer group until `stop_event` is set."""
+    # Ctrl+C is handled by the parent, which stops every worker cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    writer = CassandraWriteEngine(
+        setup_cassandra_session(),
+        concurrency=concurrency,
+        # The pipeline decides when to flush
+        batch_size=batch_size + 1,
+        # Invalidates the API's cached /states, /device_ids and /dates
+        notifier=ChangeNotifier(Generations(SHARED_CACHE_PATH)),
+    )
+    pipeline = IngestPipeline(writer, batch_size, flush_interval)
+    consumer = setup_kafka_consumer(
+        group_id, listener=pipeline, max_poll_records=MAX_POLL_RECORDS
+    )
+    elapsed = pipeline.run(consumer, stop_event)
+    results.put({
+        "worker": worker_id,
+        "consumed": pipeline.consumed,
+        "skipped": pipeline.skipped,
+        "elapsed": elapsed,
+        "rows_per_sec": pipeline.consumed / elapsed if elapsed else 0.0,
+        "pauses": pipeline.pauses,
+        "paused_time": pipeline.paused_time,
+        "rebalances": pipeline.rebalances,
+        "error": None if pipeline.writer_error is None else repr(pipeline.writer_error),
+        "cassandra": writer.stats(),
+    })
+
+
+def report(results):
+    print(f"{'worker':>6} {'consumed':>10} {'rows/s':>9} {'failed':>7} "
+          f"{'pauses':>7} {'paused s':>9} {'rebalances':>11}")
+    for r in sorted(results, key=lambda r: r["worker"]):
+        print(f"{r['worker']:>6} {r['consumed']:>10} {r['rows_per_sec']:>9.0f} "
+              f"{r['cassandra']['rows_failed']:>7} {r['pauses']:>7} "
+              f"{r['paused_time']:>9.1f} {r['rebalances']:>11}")
+        if r["error"]:
+            print(f"       stopped early: {r['error']}")
+    print(f"Total: {sum(r['consumed'] for r in results)} rows, "
+          f"{sum(r['rows_per_sec'] for r in results):.0f} rows/s across "
+          f"{len(results)} workers")
+
+
+def run_group(num_workers=NUM_PARTITIONS, group_id=INGEST_GROUP_ID,
+              batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, concurrency=64,
+              duration=None):
+    """
+    Run `num_workers` consumer processes in one group. Kafka gives each its
+    own share of the partitions, so with one worker per partition decoding
+    and writing scale with NUM_PARTITIONS; workers beyond the partition count
+    sit idle until a rebalance hands them a partition.
+    """
+    # Cassandra and Kafka clients start background threads, so workers are
+    # spawned rather than forked
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    result_queue = context.Queue()
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(worker_id, group_id, batch_size, flush_interval, concurrency,
+                  stop_event, result_queue),
+        )
+        for worker_id in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        stop_event.wait(duration)
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+
+    results = []
+    for _ in workers:
+        results.append(result_queue.get())
+    for worker in workers:
+        worker.join()
+
+    report(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Ingest the '{TOPIC_NAME}' topic into Cassandra with a "
+                    f"group of worker processes"
+    )
+    parser.add_argument("--workers", type=int, default=NUM_PARTITIONS,
+                        help="Consumer processes, one per partition by default")
+    parser.add_argument("--group-id", default=INGEST_GROUP_ID)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL)
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="Max Cassandra writes in flight per worker")
+    parser.add_argument("--duration", type=float,
+                        help="Seconds to run, until Ctrl+C by default")
+    args = parser.parse_args()
+
+    run_group(
+        args.workers,
+        args.group_id,
+        args.batch_size,
+        args.flush_interval,
+        args.concurrency,
+        args.duration,
+    )
@@ -0,0 +1,152 @@
+import argparse
+import time
+
+from kafka import KafkaConsumer
+
+from cassandra_kafka_setup import TOPIC_NAME
+from cassandra_writer import CassandraWriteEngine, validate_record
+from response_cache import SHARED_CACHE_PATH, ChangeNotifier, Generations
+from stream_sinks import BOOTSTRAP_SERVERS, record_table, setup_cassandra_session
+from wire_format import decode_message
+
+# Constants for the ingestion service
+INGEST_GROUP_ID = "cassandra-ingest"
+BATCH_SIZE = 2000  # Rows per micro-batch
+FLUSH_INTERVAL = 1.0  # Max seconds a row waits before its batch is written
+POLL_TIMEOUT_MS = 500
+RETRY_BACKOFF = 2.0  # Seconds to wait before re-reading a failed batch
+REPORT_INTERVAL = 30.0
+
+
+# Kafka Consumer setup
+def setup_kafka_consumer(group_id=INGEST_GROUP_ID, listener=None, **config):
+    consumer = KafkaConsumer(
+        bootstrap_servers=[BOOTSTRAP_SERVERS],
+        group_id=group_id,
+        enable_auto_commit=False,
+        auto_offset_reset="earliest",
+        **config,
+    )
+    consumer.subscribe([TOPIC_NAME], listener=listener)
+    return consumer
+
+
+class IngestService:
+    """
+    Consumes the topic and writes each record to the table matching its
+    metric_type/data_type/activity_type.
+
+    Records are written in micro-batches through the write engine, which
+    groups them by device_id and uses prepared statements. Offsets are
+    committed only after Cassandra has acknowledged the whole batch; if any
+    write fails the consumer rewinds to the last commit and retries, so every
+    record is written at least once.
+    """
+
+    def __init__(self, consumer, writer, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.consumer = consumer
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.skipped = 0
+        self.batch_started = None
+        self.failed_at_batch_start = 0
+
+    def handle(self, message):
+        try:
+            data = decode_message(message.value)
+            table = record_table(data)
+            # Missing columns would otherwise fail the flush on every retry
+            validate_record(table, data)
+        except Exception as e:
+            # A record we can't decode or bind will never succeed, skip it
+            self.skipped += 1
+            print(f"Skipping undecodable record at {message.topic}/"
+                  f"{message.partition}@{message.offset}: {e}")
+            return
+        if self.batch_started is None:
+            self.batch_started = time.monotonic()
+            # The engine may flush on its own mid-batch, so failures are
+            # counted from the start of the batch
+            self.failed_at_batch_start = self.writer.rows_failed
+        self.writer.add(table, data)
+        self.pending += 1
+
+    def commit_batch(self):
+        """Write the pending batch, then commit offsets or rewind on failure."""
+        self.writer.flush()
+        if self.writer.rows_failed == self.failed_at_batch_start:
+            self.consumer.commit()
+        else:
+            print(f"Batch had failed writes, retrying from the last commit "
+                  f"in {RETRY_BACKOFF:.0f}s")
+            time.sleep(RETRY_BACKOFF)
+            self.rewind()
+        self.pending = 0
+        self.batch_started = None
+
+    def rewind(self):
+        for partition in self.consumer.assignment():
+            committed = self.consumer.committed(partition)
+            if committed is None:
+                self.consumer.seek_to_beginning(partition)
+            else:
+                self.consumer.seek(partition, committed)
+
+    def batch_due(self):
+        if self.pending >= self.batch_size:
+            return True
+        return (
+            self.batch_started is not None
+            and time.monotonic() - self.batch_started >= self.flush_interval
+        )
+
+    def run(self):
+        last_report = time.monotonic()
+        try:
+            while True:
+                batches = self.consumer.poll(
+                    timeout_ms=POLL_TIMEOUT_MS, max_records=self.batch_size
+                )
+                for messages in batches.values():
+                    for message in messages:
+                        self.handle(message)
+                if self.pending and self.batch_due():
+                    self.commit_batch()
+
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    self.writer.report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.pending:
+                self.commit_batch()
+            self.consumer.close()
+            self.writer.report()
+            if self.skipped:
+                print(f"Skipped {self.skipped} undecodable records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Ingest the '{TOPIC_NAME}' topic into Cassandra"
+    )
+    parser.add_argument("--group-id", default=INGEST_GROUP_ID)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL)
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="Max Cassandra writes in flight")
+    args = parser.parse_args()
+
+    consumer = setup_kafka_consumer(args.group_id)
+    writer = CassandraWriteEngine(
+        setup_cassandra_session(),
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        # Invalidates the API's cached /states, /device_ids and /dates
+        notifier=ChangeNotifier(Generations(SHARED_CACHE_PATH)),
+    )
+    IngestService(consumer, writer, args.batch_size, args.flush_interval).run()
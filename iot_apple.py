@@ -1,9 +1,38 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from cassandra.cluster import Cluster
 from datetime import datetime, timedelta
 from collections import defaultdict
+from itertools import chain
+import heapq
 import pandas as pd
 
+from aggregation import (
+    AGGREGATE_TABLES,
+    aggregate_frame,
+    grid_records,
+    parse_aggregates,
+    parse_bucket,
+    parse_group_by,
+    rows_to_frame,
+)
+from cassandra_kafka_setup import ROLLUP_WINDOWS
+from downsampling import downsample, parse_max_points
+from query_planner import QueryPlanner, QueryRejected
+from response_cache import Generations, ResponseCache, SqliteBackend
+from response_formats import (
+    ARROW_STREAM,
+    COLUMNAR_JSON,
+    FORMATS,
+    JSON,
+    NDJSON,
+    arrow_schema,
+    arrow_stream,
+    columnar_json,
+    frame_batches,
+    record_batches,
+)
+from time_buckets import bucket_start, days_to_buckets, table_bucket
+
 app = Flask(__name__)
 
 # Connect to Cassandra
@@ -11,6 +40,19 @@ cluster = Cluster(["127.0.0.1"])
 session = cluster.connect()
 session.set_keyspace("apple_watch_iot")
 
+# Cross-device queries on the time-series tables read every partition; set to
+# False to answer those with a 400 instead of a token-range scan
+ALLOW_FULL_SCANS = True
+planner = QueryPlanner(session, allow_scans=ALLOW_FULL_SCANS)
+
+# Responses of the lookup endpoints are cached per process; set to True to
+# share them between workers through the local sqlite file instead. Either
+# way ingestion invalidates them as soon as new states, devices or dates land.
+SHARED_RESPONSE_CACHE = False
+response_cache = ResponseCache(
+    SqliteBackend() if SHARED_RESPONSE_CACHE else None, Generations()
+)
+
 
 # Utility function for formatting rows
 def format_row(row, fields):
@@ -22,33 +64,112 @@ def format_row(row, fields):
     return row_data
 
 
-# Generic Query Function
-def query_table(table_name, query_params, fields="*"):
-    conditions = []
-    params = []
-
-    for key, value in query_params.items():
-        if key == "start_time":
-            conditions.append("timestamp >= %s")
-            params.append(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
-        elif key == "end_time":
-            conditions.append("timestamp <= %s")
-            params.append(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
-        else:
-            conditions.append(f"{key} = %s")
-            params.append(value)
-
-    query = f"SELECT {fields} FROM {table_name}"
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    query += " ALLOW FILTERING;"
-
-    rows = session.execute(query, tuple(params))
-    result = [
-        format_row(row, fields.split(",") if fields != "*" else row._fields)
-        for row in rows
-    ]
-    return result
+def response_format():
+    """Media type to answer with, negotiated from the Accept header."""
+    return request.accept_mimetypes.best_match(FORMATS) or JSON
+
+
+def wants_ndjson():
+    """Whether the client asked for a streamed newline-delimited JSON response."""
+    return response_format() == NDJSON
+
+
+def ndjson_response(rows, headers=None):
+    """
+    Stream row dicts as newline-delimited JSON. Rows are serialized as the
+    generator produces them, so the first bytes go out with the first driver
+    page and only one page is held at a time.
+    """
+    def generate():
+        for row in rows:
+            yield app.json.dumps(row) + "\n"
+
+    return Response(generate(), mimetype=NDJSON, headers=headers)
+
+
+def columnar_response(batches, schema, media_type, headers=None, body=None):
+    """
+    Arrow IPC stream (batches sent as they are converted) or column-oriented
+    JSON with epoch-ms timestamps; `body` adds fields to the JSON object.
+    """
+    if media_type == ARROW_STREAM:
+        return Response(arrow_stream(batches, schema), mimetype=ARROW_STREAM, headers=headers)
+    body = {**columnar_json(batches, schema), **(body or {})}
+    return Response(app.json.dumps(body), mimetype=COLUMNAR_JSON, headers=headers)
+
+
+def execute_in_buckets(query, params, buckets):
+    """Run `query` once per time bucket, bound as its last parameter."""
+    if buckets is None:
+        return list(session.execute(query, params))
+    rows = []
+    for bucket in buckets:
+        rows.extend(session.execute(query, params + (bucket,)))
+    return rows
+
+
+def max_points_arg():
+    max_points = request.args.get("max_points")
+    return None if max_points is None else parse_max_points(max_points)
+
+
+def table_response(table_name, query_params, series=None):
+    """
+    Response of the table endpoints. With `limit` or `cursor` the rows come
+    one page at a time as {"data": [...], "next_cursor": ...}; pass
+    next_cursor back as `cursor` (with the same filters) for the next page.
+    The Accept header picks JSON, NDJSON, columnar JSON or an Arrow stream.
+
+    Time-series endpoints pass the fields that tell their `series` apart;
+    they accept `max_points`, which LTTB-downsamples each series.
+    """
+    fields = request.args.get("fields", "*")
+    query_params = {k: v for k, v in query_params.items() if v is not None}
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    paged = limit is not None or cursor is not None
+    max_points = max_points_arg() if series is not None else None
+    if max_points is not None and paged:
+        raise QueryRejected("max_points can't be combined with limit or cursor")
+
+    # Planned up front so a rejected query is still a 400 when streaming
+    plan = planner.plan(table_name, query_params, fields)
+    columns = plan.columns
+    if max_points is not None and columns:
+        # Downsampling reads the time, value and series fields even when the
+        # projection leaves them out; only the requested fields are returned
+        missing = [field for field in ("timestamp", "value", *series) if field not in columns]
+        if missing:
+            plan = planner.plan(table_name, query_params, ",".join(columns + missing))
+    media_type = response_format()
+    if max_points is not None:
+        rows, next_cursor = downsample(list(planner.execute(plan)), max_points, series), None
+    elif paged:
+        rows, next_cursor = planner.execute_page(plan, limit, cursor)
+    elif media_type in (NDJSON, ARROW_STREAM):
+        # Streamed formats read one partition at a time so memory stays flat
+        rows, next_cursor = planner.stream(plan), None
+    else:
+        # The whole body is built anyway, so read the partitions concurrently
+        rows, next_cursor = planner.execute(plan), None
+    # Formats without an envelope carry the next cursor in a header
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+
+    if media_type in (ARROW_STREAM, COLUMNAR_JSON):
+        schema = arrow_schema(planner.table_metadata(table_name), columns)
+        body = {"next_cursor": next_cursor} if paged else None
+        return columnar_response(record_batches(rows, schema), schema, media_type, headers, body)
+    rows = (format_row(row, columns or row._fields) for row in rows)
+    if media_type == NDJSON:
+        return ndjson_response(rows, headers)
+    if paged:
+        return jsonify({"data": list(rows), "next_cursor": next_cursor}), 200
+    return jsonify(list(rows)), 200
+
+
+@app.errorhandler(QueryRejected)
+def query_rejected(error):
+    return jsonify({"error": str(error)}), 400
 
 
 # Existing API Endpoints for Each Table
@@ -58,19 +179,26 @@ def query_table(table_name, query_params, fields="*"):
 # New Endpoint: Get list of states
 @app.route("/states", methods=["GET"])
 def get_states():
-    query = "SELECT * FROM environmental_data;"
-    rows = session.execute(query)
-    states = sorted({row.state for row in rows if row.state})
-    
+    def load():
+        # Only the partition keys of the small devices_by_state table are read
+        query = "SELECT DISTINCT state FROM devices_by_state;"
+        rows = session.execute(query)
+        return sorted({row.state for row in rows if row.state})
+
+    states = response_cache.get_or_compute("/states", request.args, load)
     return jsonify(states), 200
 
 
 # New Endpoint: Get list of device IDs
 @app.route("/device_ids", methods=["GET"])
 def get_device_ids():
-    query = "SELECT DISTINCT device_id FROM health_metrics;"
-    rows = session.execute(query)
-    device_ids = sorted({row.device_id for row in rows if row.device_id})
+    def load():
+        # Every device with readings has a dates_by_device partition
+        query = "SELECT DISTINCT device_id FROM dates_by_device;"
+        rows = session.execute(query)
+        return sorted({row.device_id for row in rows if row.device_id})
+
+    device_ids = response_cache.get_or_compute("/device_ids", request.args, load)
     return jsonify(device_ids), 200
 
 
@@ -81,11 +209,12 @@ def get_dates():
     if not device_id:
         return jsonify({"error": "device_id is required"}), 400
 
-    query = "SELECT timestamp FROM health_metrics WHERE device_id = %s ALLOW FILTERING;"
-    rows = session.execute(query, (device_id,))
-    dates = sorted(
-        {row.timestamp.strftime("%Y-%m-%d") for row in rows if row.timestamp}
-    )
+    def load():
+        query = "SELECT day FROM dates_by_device WHERE device_id = %s;"
+        rows = session.execute(query, (device_id,))
+        return sorted({str(row.day) for row in rows})
+
+    dates = response_cache.get_or_compute("/dates", request.args, load)
     return jsonify(dates), 200
 
 
@@ -95,36 +224,46 @@ def get_stress_levels():
     state = request.args.get("state")
     if not state:
         return jsonify({"error": "state is required"}), 400
-
-    # Get device_ids for the given state
-    query = f"SELECT *  FROM environmental_data WHERE state = '{state}' ALLOW FILTERING;"
-    print(query)
-    device_rows = session.execute(query)
-    print(device_rows)
-    device_ids = list(set([row.device_id for row in device_rows]))
-
-    # Collect stress level data for all devices in the state
-    stress_levels = []
-    for device_id in device_ids:
-        query = """
-            SELECT timestamp, value FROM health_metrics
-            WHERE device_id = %s AND metric_type = 'stress_level' ALLOW FILTERING;
-        """
-        rows = session.execute(query, (device_id,))
-        stress_levels.extend(
-            [
-                {
-                    "timestamp": row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                    "value": row.value,
-                    "device_id": device_id,
-                }
-                for row in rows
-            ]
-        )
-
-    # Sort data by timestamp
-    stress_levels.sort(key=lambda x: x["timestamp"])
-    return jsonify(stress_levels), 200
+    max_points = max_points_arg()
+
+    device_ids = planner.devices_in_state(state)
+
+    # One read per device (and time bucket), run concurrently
+    bucket = table_bucket(session, "health_metrics")
+    bucket_condition = f" AND {bucket} = ?" if bucket else ""
+    query = planner.prepare(f"""
+        SELECT device_id, timestamp, value FROM health_metrics
+        WHERE device_id = ? AND metric_type = 'stress_level'{bucket_condition}
+        ORDER BY metric_type DESC, timestamp ASC;
+    """)
+    if bucket:
+        dates = planner.prepare("SELECT day FROM dates_by_device WHERE device_id = ?;")
+        device_days = planner.fan_out(dates, [(device_id,) for device_id in device_ids])
+        params = [
+            (device_id, day)
+            for device_id, days in zip(device_ids, device_days)
+            for day in days_to_buckets([row.day for row in days], bucket)
+        ]
+    else:
+        params = [(device_id,) for device_id in device_ids]
+    partitions = planner.fan_out(query, params)
+
+    # Every partition comes back oldest first, so a k-way merge yields the
+    # whole state in timestamp order without sorting it again
+    rows = heapq.merge(*partitions, key=lambda row: row.timestamp)
+    if max_points is not None:
+        rows = downsample(list(rows), max_points, series=("device_id",))
+    stress_levels = (
+        {
+            "timestamp": row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "value": row.value,
+            "device_id": row.device_id,
+        }
+        for row in rows
+    )
+    if wants_ndjson():
+        return ndjson_response(stress_levels)
+    return jsonify(list(stress_levels)), 200
 
 
 # New Endpoint: Get heart rate data for a device on a specific date
@@ -140,12 +279,19 @@ def get_heart_rate():
         end_date = start_date + timedelta(days=1)
     except ValueError:
         return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+    max_points = max_points_arg()
 
-    query = """
+    # One day never spans more than one day or week bucket
+    bucket = table_bucket(session, "health_metrics")
+    bucket_condition = f" AND {bucket} = %s" if bucket else ""
+    buckets = [bucket_start(start_date, bucket)] if bucket else None
+    query = f"""
         SELECT timestamp, value FROM health_metrics
-        WHERE device_id = %s AND metric_type = 'heart_rate' AND timestamp >= %s AND timestamp < %s ALLOW FILTERING;
+        WHERE device_id = %s AND metric_type = 'heart_rate' AND timestamp >= %s AND timestamp < %s{bucket_condition};
     """
-    rows = session.execute(query, (device_id, start_date, end_date))
+    rows = execute_in_buckets(query, (device_id, start_date, end_date), buckets)
+    if max_points is not None:
+        rows = downsample(rows, max_points)
     heart_rates = [
         {"timestamp": row.timestamp.strftime("%Y-%m-%d %H:%M:%S"), "value": row.value}
         for row in rows
@@ -154,6 +300,26 @@ def get_heart_rate():
     return jsonify(heart_rates), 200
 
 
+def state_days(state):
+    """Days with readings from any device in the state, newest first."""
+    query = planner.prepare("SELECT day FROM dates_by_device WHERE device_id = ?;")
+    device_days = planner.fan_out(
+        query, [(device_id,) for device_id in planner.devices_in_state(state)]
+    )
+    days = {row.day for rows in device_days for row in rows}
+    return sorted(days, key=str, reverse=True)
+
+
+def state_environment(state, days, data_type):
+    """Readings of one data type in the state on the given days, read concurrently."""
+    query = planner.prepare("""
+        SELECT timestamp, value_num FROM environment_by_state_and_day
+        WHERE state = ? AND day = ? AND data_type = ?;
+    """)
+    partitions = planner.fan_out(query, [(state, day, data_type) for day in days])
+    return [row for rows in partitions for row in rows]
+
+
 # New Endpoint: Get weather data by state
 @app.route("/weather", methods=["GET"])
 def get_weather():
@@ -161,30 +327,33 @@ def get_weather():
     if not state:
         return jsonify({"error": "state is required"}), 400
 
+    # One (state, day) partition per data type; the most recent day with
+    # data by default
+    date_str = request.args.get("date")
+    if date_str:
+        try:
+            days = [datetime.strptime(date_str, "%Y-%m-%d").date()]
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+    else:
+        days = state_days(state)[:1]
+
     # Get temperature data
-    temp_query = """
-        SELECT timestamp, value FROM environmental_data
-        WHERE state = %s AND data_type = 'temperature' ALLOW FILTERING;
-    """
-    temp_rows = session.execute(temp_query, (state,))
+    temp_rows = state_environment(state, days, "temperature")
     temp_data = [
         {
             "timestamp": row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "temperature": float(row.value.replace("°C", "")),
+            "temperature": row.value_num,
         }
         for row in temp_rows
     ]
 
     # Get humidity data
-    hum_query = """
-        SELECT timestamp, value FROM environmental_data
-        WHERE state = %s AND data_type = 'humidity' ALLOW FILTERING;
-    """
-    hum_rows = session.execute(hum_query, (state,))
+    hum_rows = state_environment(state, days, "humidity")
     hum_data = [
         {
             "timestamp": row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "humidity": float(row.value.replace("%", "")),
+            "humidity": row.value_num,
         }
         for row in hum_rows
     ]
@@ -201,6 +370,8 @@ def get_weather():
     else:
         merged_df = temp_df if not temp_df.empty else hum_df
 
+    if merged_df.empty:
+        return jsonify([]), 200
     merged_df = merged_df.sort_values("timestamp")
     weather_data = merged_df.to_dict(orient="records")
     return jsonify(weather_data), 200
@@ -212,10 +383,7 @@ def device_metadata():
     query_params = {
         "device_id": request.args.get("device_id"),
     }
-    fields = request.args.get("fields", "*")
-    query_params = {k: v for k, v in query_params.items() if v is not None}
-    result = query_table("device_metadata", query_params, fields)
-    return jsonify(result), 200
+    return table_response("device_metadata", query_params)
 
 
 @app.route("/health_metrics", methods=["GET"])
@@ -226,10 +394,22 @@ def health_metrics():
         "start_time": request.args.get("start_time"),
         "end_time": request.args.get("end_time"),
     }
-    fields = request.args.get("fields", "*")
-    query_params = {k: v for k, v in query_params.items() if v is not None}
-    result = query_table("health_metrics", query_params, fields)
-    return jsonify(result), 200
+    return table_response("health_metrics", query_params, series=("device_id", "metric_type"))
+
+
+@app.route("/health_metrics_rollup", methods=["GET"])
+def health_metrics_rollup():
+    window = request.args.get("window", "1h")
+    if window not in ROLLUP_WINDOWS:
+        return jsonify({"error": f"window must be one of {', '.join(ROLLUP_WINDOWS)}"}), 400
+
+    query_params = {
+        "device_id": request.args.get("device_id"),
+        "metric_type": request.args.get("metric_type"),
+        "start_time": request.args.get("start_time"),
+        "end_time": request.args.get("end_time"),
+    }
+    return table_response(f"health_metrics_{window}", query_params)
 
 
 @app.route("/activity_tracking", methods=["GET"])
@@ -240,10 +420,7 @@ def activity_tracking():
         "start_time": request.args.get("start_time"),
         "end_time": request.args.get("end_time"),
     }
-    fields = request.args.get("fields", "*")
-    query_params = {k: v for k, v in query_params.items() if v is not None}
-    result = query_table("activity_tracking", query_params, fields)
-    return jsonify(result), 200
+    return table_response("activity_tracking", query_params)
 
 
 @app.route("/environmental_data", methods=["GET"])
@@ -256,10 +433,7 @@ def environmental_data():
         "state": request.args.get("state"),
         "town": request.args.get("town"),
     }
-    fields = request.args.get("fields", "*")
-    query_params = {k: v for k, v in query_params.items() if v is not None}
-    result = query_table("environmental_data", query_params, fields)
-    return jsonify(result), 200
+    return table_response("environmental_data", query_params)
 
 
 @app.route("/notifications", methods=["GET"])
@@ -271,10 +445,7 @@ def notifications():
         "end_time": request.args.get("end_time"),
         "is_read": request.args.get("is_read"),
     }
-    fields = request.args.get("fields", "*")
-    query_params = {k: v for k, v in query_params.items() if v is not None}
-    result = query_table("notifications", query_params, fields)
-    return jsonify(result), 200
+    return table_response("notifications", query_params)
 
 
 @app.route("/device_status_logs", methods=["GET"])
@@ -285,10 +456,71 @@ def device_status_logs():
         "start_time": request.args.get("start_time"),
         "end_time": request.args.get("end_time"),
     }
-    fields = request.args.get("fields", "*")
+    return table_response("device_status_logs", query_params)
+
+
+def device_states():
+    """device_id -> state from devices_by_state."""
+    statement = planner.prepare("SELECT state, device_id FROM devices_by_state;")
+    return {row.device_id: row.state for row in session.execute(statement)}
+
+
+@app.route("/aggregate", methods=["GET"])
+def aggregate():
+    """
+    Aggregated grid of one table's values, e.g.
+    /aggregate?table=health_metrics&metric_type=stress_level&group_by=state&agg=mean,p95
+    Only the projected columns of the matching rows are read, and only the
+    aggregated rows are returned.
+    """
+    table = request.args.get("table", "health_metrics")
+    if table not in AGGREGATE_TABLES:
+        return jsonify({"error": f"table must be one of {', '.join(AGGREGATE_TABLES)}"}), 400
+    type_column, value_column = AGGREGATE_TABLES[table]
+    group_by = parse_group_by(request.args.get("group_by", ""), type_column)
+    aggregates = parse_aggregates(request.args.get("agg", "count,mean"))
+    bucket = parse_bucket(request.args.get("bucket"))
+
+    query_params = {
+        "device_id": request.args.get("device_id"),
+        type_column: request.args.get(type_column),
+        "start_time": request.args.get("start_time"),
+        "end_time": request.args.get("end_time"),
+    }
     query_params = {k: v for k, v in query_params.items() if v is not None}
-    result = query_table("device_status_logs", query_params, fields)
-    return jsonify(result), 200
+    columns = ["device_id", "timestamp", type_column, value_column]
+    fields = ",".join(columns)
+
+    # A state is read as its devices' partitions
+    state = request.args.get("state")
+    if state:
+        device_ids = planner.devices_in_state(state)
+        if "device_id" in query_params:
+            device_ids = [d for d in device_ids if d == query_params["device_id"]]
+        plans = [
+            planner.plan(table, {**query_params, "device_id": device_id}, fields)
+            for device_id in device_ids
+        ]
+    else:
+        plans = [planner.plan(table, query_params, fields)]
+
+    rows = chain.from_iterable(planner.stream(plan) for plan in plans)
+    frame = rows_to_frame(rows, columns).rename(columns={value_column: "value"})
+    states = device_states() if "state" in group_by else None
+    grid = aggregate_frame(frame, group_by, bucket, aggregates, states)
+    media_type = response_format()
+    if media_type in (ARROW_STREAM, COLUMNAR_JSON):
+        batches, schema = frame_batches(grid)
+        return columnar_response(batches, schema, media_type)
+    return jsonify(grid_records(grid)), 200
+
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "responses": response_cache.stats(),
+        "prepared_statements": planner.stats(),
+    }), 200
 
 
 @app.route("/")
@@ -0,0 +1,102 @@
+import random
+import threading
+import time
+
+from kafka.codec import has_lz4
+
+from cassandra_writer import percentile
+
+# Producer settings for throughput mode: wait a little to fill large
+# compressed batches and only require the leader's acknowledgement
+THROUGHPUT_PRODUCER_CONFIG = {
+    "linger_ms": 20,
+    "batch_size": 256 * 1024,
+    "compression_type": "lz4" if has_lz4() else "gzip",
+    "acks": 1,
+    "buffer_memory": 64 * 1024 * 1024,
+    "max_in_flight_requests_per_connection": 5,
+    "retries": 3,
+}
+
+# Number of ack latencies kept for the percentile estimates
+LATENCY_SAMPLE_SIZE = 100_000
+
+
+class DeliveryTracker:
+    """
+    Tracks asynchronous Kafka deliveries through future callbacks.
+
+    Callbacks run on the producer's sender thread, so counters are guarded by
+    a lock. Ack latencies are reservoir sampled to keep memory flat on long
+    runs.
+    """
+
+    def __init__(self, sample_size=LATENCY_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.bytes = 0
+        self.latencies = []
+        self.started_at = time.perf_counter()
+        self._seen_latencies = 0
+        self._lock = threading.Lock()
+
+    def send(self, producer, topic, value, key=None, partition=None):
+        """Send a record without blocking and register delivery callbacks."""
+        start = time.perf_counter()
+        future = producer.send(topic, value=value, key=key, partition=partition)
+        self.sent += 1
+        future.add_callback(self._on_success, start)
+        future.add_errback(self._on_error)
+        return future
+
+    def _record_latency(self, latency):
+        self._seen_latencies += 1
+        if len(self.latencies) < self.sample_size:
+            self.latencies.append(latency)
+        else:
+            index = random.randrange(self._seen_latencies)
+            if index < self.sample_size:
+                self.latencies[index] = latency
+
+    def _on_success(self, start, metadata):
+        latency = time.perf_counter() - start
+        size = max(metadata.serialized_value_size, 0) + max(
+            metadata.serialized_key_size, 0
+        )
+        with self._lock:
+            self.acked += 1
+            self.bytes += size
+            self._record_latency(latency)
+
+    def _on_error(self, exc):
+        with self._lock:
+            self.failed += 1
+            # Only log the first few failures, the summary has the total
+            if self.failed <= 10:
+                print(f"Kafka delivery failed: {exc}")
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started_at
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "acked": self.acked,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "msgs_per_sec": self.acked / elapsed if elapsed else 0.0,
+                "ack_latency_p50_ms": percentile(self.latencies, 50) * 1000,
+                "ack_latency_p99_ms": percentile(self.latencies, 99) * 1000,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        print(
+            f"Kafka delivery: {stats['sent']} sent, {stats['acked']} acked, "
+            f"{stats['failed']} failed, {stats['bytes']} bytes, "
+            f"{stats['msgs_per_sec']:.0f} msg/s, "
+            f"ack latency p50={stats['ack_latency_p50_ms']:.1f}ms "
+            f"p99={stats['ack_latency_p99_ms']:.1f}ms"
+        )
+        return stats
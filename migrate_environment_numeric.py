@@ -0,0 +1,111 @@
+import argparse
+
+from cassandra import InvalidRequest
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import UNSET_VALUE, SimpleStatement
+
+from cassandra_writer import parse_environment_value
+from stream_sinks import setup_cassandra_session
+from time_buckets import table_bucket
+
+FETCH_SIZE = 5000  # Rows per page of the scans
+CONCURRENCY = 64  # Updates in flight
+
+# Numeric columns added to each table, and the primary key of its rows
+NEW_COLUMNS = {
+    "environmental_data": {"value_num": "float", "latitude": "double", "longitude": "double"},
+    "environment_by_state_and_day": {"value_num": "float"},
+}
+PRIMARY_KEYS = {
+    "environmental_data": ["device_id", "data_type", "timestamp"],
+    "environment_by_state_and_day": ["state", "day", "data_type", "timestamp", "device_id"],
+}
+
+
+def add_columns(session, table):
+    for column, column_type in NEW_COLUMNS[table].items():
+        try:
+            session.execute(f"ALTER TABLE {table} ADD {column} {column_type};")
+            print(f"Added {table}.{column}")
+        except InvalidRequest:
+            # Already there: created by a newer setup or an earlier run
+            pass
+
+
+def backfill(session, table):
+    """
+    Fill the numeric columns of rows written before they existed. Rows that
+    already have them are skipped, so the migration can be rerun. Each update
+    keeps the row's remaining TTL so the new cells expire with the row.
+    """
+    key_columns = list(PRIMARY_KEYS[table])
+    bucket = table_bucket(session, table)
+    if bucket is not None:
+        key_columns.insert(1, bucket)
+    columns = list(NEW_COLUMNS[table])
+
+    scan = SimpleStatement(
+        f"SELECT {', '.join(key_columns)}, value, TTL(value) AS ttl, "
+        f"{', '.join(columns)} FROM {table};",
+        fetch_size=FETCH_SIZE,
+    )
+    update = session.prepare(
+        f"UPDATE {table} USING TTL ? SET "
+        f"{', '.join(f'{column} = ?' for column in columns)} "
+        f"WHERE {' AND '.join(f'{column} = ?' for column in key_columns)};"
+    )
+
+    scanned = updated = failed = 0
+    pending = []
+
+    def flush():
+        nonlocal updated, failed
+        results = execute_concurrent(
+            session, pending, concurrency=CONCURRENCY, raise_on_first_error=False
+        )
+        for success, result in results:
+            if success:
+                updated += 1
+            else:
+                failed += 1
+                print(f"Update failed: {result}")
+        pending.clear()
+
+    for row in session.execute(scan):
+        scanned += 1
+        if any(getattr(row, column) is not None for column in columns):
+            continue
+        value_num, latitude, longitude = parse_environment_value(row.data_type, row.value)
+        numbers = {"value_num": value_num, "latitude": latitude, "longitude": longitude}
+        if all(numbers[column] is None for column in columns):
+            continue
+        pending.append((
+            update,
+            [row.ttl or 0]
+            + [UNSET_VALUE if numbers[column] is None else numbers[column]
+               for column in columns]
+            + [getattr(row, column) for column in key_columns],
+        ))
+        if len(pending) >= FETCH_SIZE:
+            flush()
+    if pending:
+        flush()
+    print(f"{table}: scanned {scanned} rows, updated {updated}, {failed} failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Add numeric value columns to the environmental tables and "
+                    "backfill them from the text values"
+    )
+    parser.add_argument("--tables", nargs="+", choices=list(NEW_COLUMNS),
+                        default=list(NEW_COLUMNS))
+    args = parser.parse_args()
+
+    session = setup_cassandra_session()
+    for table in args.tables:
+        add_columns(session, table)
+    # Pick up the new columns before preparing statements against them
+    session.cluster.refresh_schema_metadata()
+    for table in args.tables:
+        backfill(session, table)
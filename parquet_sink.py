@@ -0,0 +1,158 @@
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from cassandra_writer import to_datetime
+
+# Default output directory and sizes
+PARQUET_DIR = "parquet_data"
+ROW_GROUP_SIZE = 10_000  # Rows per row group
+MAX_OPEN_FILES = 32  # Parquet writers kept open at once
+
+# Column that partitions each table by data type. It is stored in the
+# directory name (hive style), not inside the files.
+TYPE_COLUMNS = {
+    "health_metrics": "metric_type",
+    "environmental_data": "data_type",
+    "activity_tracking": "activity_type",
+}
+
+SCHEMAS = {
+    "health_metrics": pa.schema([
+        ("device_id", pa.string()),
+        ("timestamp", pa.timestamp("ms")),
+        ("value", pa.float64()),
+        ("unit", pa.string()),
+    ]),
+    "environmental_data": pa.schema([
+        ("device_id", pa.string()),
+        ("timestamp", pa.timestamp("ms")),
+        ("value", pa.string()),
+        ("town", pa.string()),
+        ("state", pa.string()),
+    ]),
+    "activity_tracking": pa.schema([
+        ("device_id", pa.string()),
+        ("timestamp", pa.timestamp("ms")),
+        ("value", pa.float64()),
+        ("unit", pa.string()),
+    ]),
+}
+
+
+class ParquetStreamSink:
+    """
+    Streams readings into Parquet files partitioned as
+    `<base_dir>/<table>/date=YYYY-MM-DD/<type column>=<value>/`.
+
+    Each partition buffers at most `row_group_size` rows before they are
+    written as a row group, and at most `max_open_files` writers stay open
+    (least recently used ones are closed), so memory stays flat however long
+    the run is.
+    """
+
+    def __init__(self, base_dir=PARQUET_DIR, row_group_size=ROW_GROUP_SIZE,
+                 max_open_files=MAX_OPEN_FILES):
+        self.base_dir = base_dir
+        self.row_group_size = row_group_size
+        self.max_open_files = max_open_files
+        self.max_buffered_rows = row_group_size * max_open_files
+        # Tag file names with the run so reruns never overwrite earlier files
+        self.run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+
+        self._buffers = {}
+        self._buffered_rows = 0
+        self._writers = OrderedDict()
+        self._file_counts = {}
+        self.rows_written = 0
+        self.files_written = 0
+
+    def write(self, table, data):
+        timestamp = to_datetime(data["timestamp"])
+        key = (table, timestamp.date().isoformat(), data[TYPE_COLUMNS[table]])
+
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = {name: [] for name in SCHEMAS[table].names}
+        for name in SCHEMAS[table].names:
+            if name == "timestamp":
+                buffer[name].append(timestamp)
+            else:
+                buffer[name].append(data.get(name, ""))
+        self._buffered_rows += 1
+
+        if len(buffer["timestamp"]) >= self.row_group_size:
+            self._flush(key)
+        elif self._buffered_rows >= self.max_buffered_rows:
+            # Too many partially filled partitions: flush the fullest one
+            self._flush(max(self._buffers, key=lambda k: len(self._buffers[k]["timestamp"])))
+
+    def _path(self, key):
+        table, date, type_value = key
+        directory = os.path.join(
+            self.base_dir, table, f"date={date}", f"{TYPE_COLUMNS[table]}={type_value}"
+        )
+        os.makedirs(directory, exist_ok=True)
+        count = self._file_counts.get(key, 0)
+        self._file_counts[key] = count + 1
+        return os.path.join(directory, f"part-{self.run_id}-{count:04}.parquet")
+
+    def _writer(self, key):
+        writer = self._writers.get(key)
+        if writer is not None:
+            self._writers.move_to_end(key)
+            return writer
+        if len(self._writers) >= self.max_open_files:
+            _, oldest = self._writers.popitem(last=False)
+            oldest.close()
+        writer = pq.ParquetWriter(self._path(key), SCHEMAS[key[0]])
+        self._writers[key] = writer
+        self.files_written += 1
+        return writer
+
+    def _flush(self, key):
+        buffer = self._buffers.pop(key, None)
+        if not buffer or not buffer["timestamp"]:
+            return
+        rows = len(buffer["timestamp"])
+        batch = pa.Table.from_pydict(buffer, schema=SCHEMAS[key[0]])
+        self._writer(key).write_table(batch, row_group_size=self.row_group_size)
+        self._buffered_rows -= rows
+        self.rows_written += rows
+
+    def close(self):
+        for key in list(self._buffers):
+            self._flush(key)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+        print(
+            f"Parquet sink: {self.rows_written} rows written to "
+            f"{self.files_written} files under '{self.base_dir}'"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_dataset(table, base_dir=PARQUET_DIR):
+    """
+    Open a table written by ParquetStreamSink as a pyarrow dataset. Filters on
+    `date` and the type column prune whole directories and `columns=` only
+    reads the requested column chunks, e.g.
+
+        open_dataset("health_metrics").to_table(
+            columns=["device_id", "value"],
+            filter=ds.field("metric_type") == "heart_rate",
+        )
+    """
+    return ds.dataset(
+        os.path.join(base_dir, table), format="parquet", partitioning="hive"
+    )
@@ -0,0 +1,93 @@
+import argparse
+import re
+import statistics
+
+from kafka.partitioner import murmur2
+
+from cassandra_kafka_setup import NUM_PARTITIONS
+
+DEVICE_NUMBER = re.compile(r"(\d+)$")
+
+
+class HashPartitioner:
+    """Kafka's default keyed partitioning: murmur2(key) modulo partition count."""
+
+    def __init__(self):
+        self._partitions = None
+
+    def choose(self, key, partitions):
+        index = (murmur2(key) & 0x7FFFFFFF) % len(partitions)
+        return partitions[index]
+
+    def partition(self, producer, topic, key):
+        # Partition metadata is looked up once per producer and topic
+        if self._partitions is None:
+            self._partitions = sorted(producer.partitions_for(topic))
+        return self.choose(key, self._partitions)
+
+
+class DeviceRangePartitioner(HashPartitioner):
+    """
+    Sticky-by-device-range partitioning: devices are numbered by the digits
+    at the end of their ID and each partition owns one contiguous range of
+    `num_devices / partitions` devices. IDs without a number fall back to
+    hashing.
+    """
+
+    def __init__(self, num_devices):
+        super().__init__()
+        self.num_devices = num_devices
+
+    def choose(self, key, partitions):
+        match = DEVICE_NUMBER.search(key.decode("utf-8"))
+        if match is None:
+            return super().choose(key, partitions)
+        number = (int(match.group(1)) - 1) % self.num_devices
+        return partitions[number * len(partitions) // self.num_devices]
+
+
+def make_partitioner(name, num_devices=None):
+    if name == "hash":
+        return HashPartitioner()
+    if name == "range":
+        if not num_devices:
+            raise ValueError("The range partitioner needs the fleet size")
+        return DeviceRangePartitioner(num_devices)
+    raise ValueError(f"Unknown partitioner: {name}")
+
+
+def partition_spread(device_ids, num_partitions, partitioner):
+    """Count how many device keys land on each partition."""
+    partitions = list(range(num_partitions))
+    counts = [0] * num_partitions
+    for device_id in device_ids:
+        counts[partitioner.choose(device_id.encode("utf-8"), partitions)] += 1
+    return counts
+
+
+def spread_report(num_devices, partition_counts, partitioner_names):
+    device_ids = [f"device_{i:06}" for i in range(1, num_devices + 1)]
+    print(f"{'partitioner':>11} {'partitions':>10} {'min':>8} {'max':>8} "
+          f"{'stdev':>8} {'max/mean':>9}")
+    for name in partitioner_names:
+        for num_partitions in partition_counts:
+            counts = partition_spread(
+                device_ids, num_partitions, make_partitioner(name, num_devices)
+            )
+            mean = num_devices / num_partitions
+            stdev = statistics.pstdev(counts)
+            print(f"{name:>11} {num_partitions:>10} {min(counts):>8} "
+                  f"{max(counts):>8} {stdev:>8.1f} {max(counts) / mean:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report how evenly device keys spread across partitions"
+    )
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--partitions", type=int, nargs="+",
+                        default=[NUM_PARTITIONS, 6, 12, 24])
+    parser.add_argument("--partitioner", nargs="+", choices=["hash", "range"],
+                        default=["hash", "range"])
+    args = parser.parse_args()
+    spread_report(args.devices, args.partitions, args.partitioner)
@@ -2,12 +2,14 @@ from cassandra.cluster import Cluster
 from kafka.admin import KafkaAdminClient, NewTopic
 import os
 import glob
+import shutil
 
 # Constants
 CASSANDRA_HOST = "127.0.0.1"
 KEYSPACE = "apple_watch_iot"
 BOOTSTRAP_SERVERS = "localhost:9092"
 TOPIC_NAME = "apple-watch-iots"
+PARQUET_DIR = "parquet_data"
 
 def purge_cassandra_data():
     try:
@@ -53,6 +55,15 @@ def delete_csv_files():
     except Exception as e:
         print(f"Error deleting CSV files: {e}")
 
+def delete_parquet_files():
+    try:
+        if os.path.isdir(PARQUET_DIR):
+            shutil.rmtree(PARQUET_DIR)
+            print(f"Deleted Parquet directory: {PARQUET_DIR}")
+
+    except Exception as e:
+        print(f"Error deleting Parquet files: {e}")
+
 if __name__ == "__main__":
     confirm = input("Are you sure you want to purge all data? This action cannot be undone. (yes/no): ")
     if confirm.lower() == "yes":
@@ -65,6 +76,9 @@ if __name__ == "__main__":
         print("Deleting generated CSV files...")
         delete_csv_files()
 
+        print("Deleting generated Parquet files...")
+        delete_parquet_files()
+
         print("Data purge completed successfully.")
     else:
         print("Data purge canceled.")
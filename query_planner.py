@@ -0,0 +1,382 @@
+import base64
+import hashlib
+import json
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime
+
+from cassandra.concurrent import execute_concurrent_with_args
+
+from time_buckets import buckets_between, days_to_buckets, table_bucket
+from token_scan import TokenRangeScan
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CACHE_SIZE = 256  # Prepared statements kept per planner
+CONCURRENCY = 32  # Partition queries in flight for one request
+DEFAULT_PAGE_SIZE = 1000  # Rows per page when only a cursor is given
+MAX_PAGE_SIZE = 10000
+
+# Request parameters that become range conditions rather than equalities
+RANGE_PARAMS = {"start_time": ("timestamp", ">="), "end_time": ("timestamp", "<=")}
+
+
+class QueryRejected(ValueError):
+    """A request the planner can't or won't run."""
+
+
+class QueryPlan:
+    """
+    How one request is answered.
+
+    `shape` is "partition" when every partition to read is known from the
+    request, "state lookup" when the devices are first found through
+    devices_by_state, and "scan" when the whole table has to be read.
+    """
+
+    def __init__(self, shape, table, columns, conditions, partitions=(),
+                 partition_columns=(), allow_filtering=False, signature=""):
+        self.shape = shape
+        self.table = table
+        self.columns = columns
+        self.conditions = conditions
+        self.partitions = list(partitions)
+        self.partition_columns = list(partition_columns)
+        self.allow_filtering = allow_filtering
+        # Identifies the request, so a cursor can't be replayed against another
+        self.signature = signature
+
+    def query(self):
+        where = [f"{column} = ?" for column in self.partition_columns]
+        where += [f"{column} {operator} ?" for column, operator, _ in self.conditions]
+        query = f"SELECT {', '.join(self.columns) if self.columns else '*'} FROM {self.table}"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        if self.allow_filtering:
+            query += " ALLOW FILTERING"
+        return query + ";"
+
+    def parameters(self):
+        values = [value for _, _, value in self.conditions]
+        return [list(partition) + values for partition in self.partitions]
+
+
+def convert(column, cql_type, value):
+    """Convert a query-string value to the column's CQL type."""
+    try:
+        if cql_type == "timestamp":
+            return datetime.strptime(value, TIME_FORMAT)
+        if cql_type == "date":
+            return date.fromisoformat(value)
+        if cql_type == "boolean":
+            if value.lower() not in ("true", "false"):
+                raise ValueError(value)
+            return value.lower() == "true"
+        if cql_type in ("int", "bigint"):
+            return int(value)
+        if cql_type in ("float", "double"):
+            return float(value)
+    except ValueError:
+        raise QueryRejected(f"Invalid value for {column} ({cql_type}): {value}")
+    return value
+
+
+def page_size(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(limit)
+    except ValueError:
+        size = 0
+    if not 1 <= size <= MAX_PAGE_SIZE:
+        raise QueryRejected(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return size
+
+
+def partition_position(values, width):
+    """
+    Sort key of one partition (or token range) of a paged query: its key
+    values as text. Cursors hold it rather than an index, because the
+    partitions a plan covers can change between two requests.
+    """
+    return [str(value) for value in values[:width]]
+
+
+def encode_cursor(signature, position, paging_state):
+    """
+    Opaque cursor: the partition (or token range) a page stopped in and the
+    driver's paging state within it.
+    """
+    token = {
+        "q": signature,
+        "p": position,
+        "s": base64.urlsafe_b64encode(paging_state).decode() if paging_state else None,
+    }
+    return base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+
+
+def decode_cursor(cursor, signature):
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        position = token["p"]
+        paging_state = base64.urlsafe_b64decode(token["s"]) if token["s"] else None
+        valid = (
+            token["q"] == signature
+            and isinstance(position, list)
+            and all(isinstance(value, str) for value in position)
+        )
+    except (ValueError, KeyError, TypeError, AttributeError):
+        valid = False
+    if not valid:
+        raise QueryRejected("Invalid cursor for this query")
+    return position, paging_state
+
+
+def needs_filtering(clustering, conditions):
+    """
+    Whether conditions on the non-partition-key columns need ALLOW FILTERING:
+    only equalities on a prefix of the clustering columns, optionally followed
+    by a range on the next one, can be served by slicing the partition.
+    """
+    restricted = {}
+    for column, operator, _ in conditions:
+        restricted.setdefault(column, set()).add(operator)
+    if any(column not in clustering for column in restricted):
+        return True
+    usable = True
+    for column in clustering:
+        operators = restricted.get(column)
+        if operators is None:
+            usable = False
+            continue
+        if not usable:
+            return True
+        if operators != {"="}:
+            usable = False
+    return False
+
+
+class QueryPlanner:
+    """
+    Plans the generic table queries of the API against each table's key
+    layout and runs them through prepared statements.
+
+    Filters and projections are checked against the schema, so only real
+    column names ever reach the CQL text, and values are converted to the
+    column types and bound. Requests that pin the partition key read only
+    those partitions (all buckets a time range overlaps on bucketed tables),
+    slicing by clustering column where possible and filtering within the
+    partition otherwise. A `state` filter without a device_id is rerouted
+    through devices_by_state. Anything else needs a full scan, which runs as
+    a token-range parallel scan or is refused when `allow_scans` is off.
+
+    Prepared statements are kept in an LRU cache keyed by the query text,
+    i.e. by table, condition set and projection.
+    """
+
+    def __init__(self, session, cache_size=CACHE_SIZE, allow_scans=True):
+        self.session = session
+        self.cache_size = cache_size
+        self.allow_scans = allow_scans
+        self._statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, query):
+        statement = self._statements.get(query)
+        if statement is not None:
+            self._statements.move_to_end(query)
+            self.hits += 1
+            return statement
+        self.misses += 1
+        statement = self.session.prepare(query)
+        self._statements[query] = statement
+        if len(self._statements) > self.cache_size:
+            self._statements.popitem(last=False)
+        return statement
+
+    def table_metadata(self, table):
+        keyspace = self.session.cluster.metadata.keyspaces[self.session.keyspace]
+        if table not in keyspace.tables:
+            raise QueryRejected(f"Unknown table: {table}")
+        return keyspace.tables[table]
+
+    def projection(self, metadata, fields):
+        if fields == "*":
+            return None
+        columns = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [column for column in columns if column not in metadata.columns]
+        if unknown or not columns:
+            raise QueryRejected(
+                f"Unknown fields for {metadata.name}: {', '.join(unknown) or fields!r}"
+            )
+        return columns
+
+    def conditions(self, metadata, params):
+        conditions = []
+        for key, value in params.items():
+            column, operator = RANGE_PARAMS.get(key, (key, "="))
+            if column not in metadata.columns:
+                raise QueryRejected(f"Unknown filter for {metadata.name}: {key}")
+            cql_type = metadata.columns[column].cql_type
+            conditions.append((column, operator, convert(column, cql_type, value)))
+        return conditions
+
+    def devices_in_state(self, state):
+        statement = self.prepare("SELECT device_id FROM devices_by_state WHERE state = ?;")
+        return [row.device_id for row in self.session.execute(statement, (state,))]
+
+    def device_buckets(self, device_id, unit):
+        statement = self.prepare("SELECT day FROM dates_by_device WHERE device_id = ?;")
+        days = [row.day for row in self.session.execute(statement, (device_id,))]
+        return days_to_buckets(days, unit)
+
+    def plan(self, table, params, fields="*"):
+        metadata = self.table_metadata(table)
+        columns = self.projection(metadata, fields)
+        conditions = self.conditions(metadata, params)
+        signature = hashlib.sha1(
+            repr((table, columns, sorted(params.items()))).encode()
+        ).hexdigest()[:16]
+
+        bucket = table_bucket(self.session, table)
+        key_columns = [
+            column.name for column in metadata.partition_key if column.name != bucket
+        ]
+        equalities = {column: value for column, operator, value in conditions
+                      if operator == "="}
+
+        if all(column in equalities for column in key_columns):
+            shape = "partition"
+            keys = [tuple(equalities[column] for column in key_columns)]
+        elif key_columns == ["device_id"] and "state" in equalities:
+            shape = "state lookup"
+            keys = [(device_id,) for device_id in self.devices_in_state(equalities["state"])]
+        elif self.allow_scans:
+            return QueryPlan("scan", table, columns, conditions, signature=signature)
+        else:
+            raise QueryRejected(
+                f"Queries on {table} need {' and '.join(key_columns)} "
+                f"(full table scans are disabled)"
+            )
+
+        remaining = [condition for condition in conditions
+                     if condition[0] not in key_columns]
+        partition_columns = list(key_columns)
+        if bucket is not None:
+            partition_columns.append(bucket)
+            keys = [key + (value,) for key in keys
+                    for value in self.buckets(key, bucket, conditions)]
+        clustering = [column.name for column in metadata.clustering_key]
+        return QueryPlan(
+            shape,
+            table,
+            columns,
+            remaining,
+            keys,
+            partition_columns,
+            allow_filtering=needs_filtering(clustering, remaining),
+            signature=signature,
+        )
+
+    def buckets(self, key, unit, conditions):
+        """Buckets of one partition that a request's time range overlaps."""
+        start = end = None
+        for column, operator, value in conditions:
+            if column == "timestamp" and operator in (">", ">="):
+                start = value
+            elif column == "timestamp" and operator in ("<", "<="):
+                end = value
+        if start is None:
+            # No lower bound: every bucket the device has written to
+            buckets = self.device_buckets(key[0], unit)
+            return [b for b in buckets if end is None or b <= end.date()]
+        return buckets_between(start, end or datetime.now(), unit)
+
+    def statement(self, plan):
+        """Prepared statement of a plan and its bound values per partition."""
+        if plan.shape == "scan":
+            scan = TokenRangeScan(self.session, plan.table, plan.columns, plan.conditions)
+            return scan.statement, scan.parameters()
+        return self.prepare(plan.query()), plan.parameters()
+
+    def execute(self, plan):
+        """Run a plan and return an iterable of rows."""
+        if plan.shape == "scan":
+            return TokenRangeScan(
+                self.session, plan.table, plan.columns, plan.conditions
+            ).rows()
+        statement, parameters = self.statement(plan)
+        if len(parameters) == 1:
+            return self.session.execute(statement, parameters[0])
+        return (row for rows in self.fan_out(statement, parameters) for row in rows)
+
+    def fan_out(self, statement, parameters):
+        """
+        Run a prepared statement once per parameter list through the driver's
+        asynchronous execution, at most CONCURRENCY requests in flight, and
+        return the result sets in order. Each holds its first page and
+        fetches the rest as it is iterated.
+        """
+        results = execute_concurrent_with_args(
+            self.session, statement, parameters, concurrency=CONCURRENCY
+        )
+        return [rows for _, rows in results]
+
+    def stream(self, plan):
+        """
+        Yield the rows of a plan, partition after partition, one driver page
+        in memory at a time (scans keep their bounded page queue).
+        """
+        if plan.shape == "scan":
+            yield from TokenRangeScan(
+                self.session, plan.table, plan.columns, plan.conditions
+            ).rows()
+            return
+        statement, parameters = self.statement(plan)
+        for values in parameters:
+            yield from self.session.execute(statement, values)
+
+    def execute_page(self, plan, limit=None, cursor=None):
+        """
+        Run a plan one page at a time: at most `limit` rows starting where
+        `cursor` left off, plus the cursor of the next page (None after the
+        last one). Partitions and token ranges are read in key order, each
+        with the driver's paging state, so a page never holds more than
+        `limit` rows however much the query matches.
+
+        The cursor names the partition to resume in, so partitions that
+        appear or disappear between requests (new buckets, devices changing
+        state) neither repeat nor skip the others.
+        """
+        size = page_size(limit)
+        statement, parameters = self.statement(plan)
+        # Scans bind the start and end token of each range first
+        width = 2 if plan.shape == "scan" else len(plan.partition_columns)
+        parameters = sorted(parameters, key=lambda values: partition_position(values, width))
+        positions = [partition_position(values, width) for values in parameters]
+        index, paging_state = 0, None
+        if cursor:
+            position, paging_state = decode_cursor(cursor, plan.signature)
+            index = bisect_left(positions, position)
+            if index == len(positions) or positions[index] != position:
+                # The partition is gone; carry on with the next one
+                paging_state = None
+        rows = []
+        while index < len(parameters) and len(rows) < size:
+            bound = statement.bind(parameters[index])
+            bound.fetch_size = size - len(rows)
+            result = self.session.execute(bound, paging_state=paging_state)
+            rows.extend(result.current_rows)
+            paging_state = result.paging_state
+            if paging_state is None:
+                index += 1
+        if index >= len(parameters):
+            return rows, None
+        return rows, encode_cursor(plan.signature, positions[index], paging_state)
+
+    def stats(self):
+        return {
+            "cached_statements": len(self._statements),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,185 @@
+import argparse
+import heapq
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from cassandra_writer import CassandraWriteEngine, percentile
+from kafka_throughput import DeliveryTracker
+from stream_sinks import send_to_kafka, setup_cassandra_session, setup_kafka_producer
+
+CHUNK_SIZE = 50_000  # Rows read (and sorted) at a time
+MERGE_BATCH_SIZE = 5_000  # Rows read from each sorted run while merging
+PROGRESS_INTERVAL = 5.0  # Seconds between progress lines
+LAG_SAMPLE_SIZE = 100_000  # Lag measurements kept for percentiles
+
+# Tables whose value column is numeric
+NUMERIC_VALUE_TABLES = {"health_metrics", "activity_tracking"}
+
+
+def detect_table(columns):
+    if "metric_type" in columns:
+        return "health_metrics"
+    if "activity_type" in columns:
+        return "activity_tracking"
+    if "data_type" in columns:
+        return "environmental_data"
+    raise ValueError(f"Cannot tell which table these columns belong to: {columns}")
+
+
+def read_chunks(path, chunk_size):
+    """Yield DataFrame chunks of a CSV file or a Parquet file/directory."""
+    if path.endswith(".csv"):
+        yield from pd.read_csv(
+            path, chunksize=chunk_size, dtype=str, keep_default_na=False
+        )
+        return
+    # Parquet output of ParquetStreamSink is hive partitioned by date and type
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+def normalize(chunk):
+    chunk = chunk.drop(columns=["date"], errors="ignore")
+    chunk["timestamp"] = pd.to_datetime(chunk["timestamp"])
+    text_columns = [c for c in chunk.columns if c not in ("timestamp", "value")]
+    chunk = chunk.fillna({column: "" for column in text_columns})
+    return chunk.sort_values("timestamp", kind="stable")
+
+
+def iter_run(path):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=MERGE_BATCH_SIZE):
+        yield from batch.to_pandas().to_dict("records")
+
+
+def iter_sorted(path, chunk_size, tmpdir):
+    """
+    Yield the rows of `path` in timestamp order without loading it whole:
+    each chunk is sorted and spilled to a Parquet run, then the runs are
+    k-way merged.
+    """
+    runs = []
+    for index, chunk in enumerate(read_chunks(path, chunk_size)):
+        run_path = os.path.join(tmpdir, f"run-{index:05}.parquet")
+        normalize(chunk).to_parquet(run_path, index=False)
+        runs.append(run_path)
+    yield from heapq.merge(*(iter_run(run) for run in runs), key=lambda r: r["timestamp"])
+
+
+def to_record(row, table):
+    record = dict(row)
+    record["timestamp"] = row["timestamp"].to_pydatetime().isoformat()
+    if table in NUMERIC_VALUE_TABLES:
+        record["value"] = float(record["value"])
+    return record
+
+
+def replay(path, speed=1.0, table=None, chunk_size=CHUNK_SIZE, use_kafka=True,
+           use_cassandra=False, wire_format="json"):
+    """
+    Replay a recorded dataset in timestamp order. `speed` scales the original
+    timeline (1 = real time, 10 = ten times faster); 0 replays as fast as
+    possible.
+    """
+    producer = tracker = writer = None
+    if use_kafka:
+        producer = setup_kafka_producer(throughput=True, wire_format=wire_format)
+        tracker = DeliveryTracker()
+    if use_cassandra:
+        writer = CassandraWriteEngine(setup_cassandra_session())
+
+    lags = []
+    replayed = 0
+    first_ts = last_ts = None
+    with tempfile.TemporaryDirectory(prefix="replay-") as tmpdir:
+        rows = iter_sorted(path, chunk_size, tmpdir)
+        start = last_progress = time.monotonic()
+        for row in rows:
+            if table is None:
+                table = detect_table(row.keys())
+            if first_ts is None:
+                first_ts = row["timestamp"]
+            last_ts = row["timestamp"]
+
+            # Wait until the row is due on the scaled original timeline
+            offset = (row["timestamp"] - first_ts).total_seconds()
+            if speed > 0:
+                due = start + offset / speed
+                now = time.monotonic()
+                if due > now:
+                    time.sleep(due - now)
+                    now = due
+                # Reservoir sample of how far behind schedule rows are sent
+                if len(lags) < LAG_SAMPLE_SIZE:
+                    lags.append(now - due)
+                else:
+                    index = random.randrange(replayed + 1)
+                    if index < LAG_SAMPLE_SIZE:
+                        lags[index] = now - due
+
+            record = to_record(row, table)
+            if producer is not None:
+                send_to_kafka(producer, record, tracker)
+            if writer is not None:
+                writer.add(table, record)
+            replayed += 1
+
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                print(f"Replayed {replayed} rows, {replayed / (now - start):.0f} rows/s, "
+                      f"timeline at {row['timestamp']}")
+        elapsed = time.monotonic() - start
+
+    if producer is not None:
+        producer.flush()
+        producer.close()
+    if writer is not None:
+        writer.flush()
+
+    span = (last_ts - first_ts).total_seconds() if replayed else 0.0
+    print(f"Replayed {replayed} rows of {table} in {elapsed:.1f}s "
+          f"({replayed / elapsed if elapsed else 0:.0f} rows/s)")
+    print(f"Original timeline: {span:.0f}s, achieved speed-up "
+          f"{span / elapsed if elapsed else 0:.1f}x (target "
+          f"{'max' if speed <= 0 else f'{speed:g}x'})")
+    if lags:
+        print(f"Lag behind schedule: p50={percentile(lags, 50) * 1000:.1f}ms "
+              f"p99={percentile(lags, 99) * 1000:.1f}ms max={max(lags) * 1000:.1f}ms")
+    if tracker is not None:
+        tracker.summary()
+    if writer is not None:
+        writer.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded CSV/Parquet dataset into Kafka and Cassandra"
+    )
+    parser.add_argument("path", help="CSV file, Parquet file or Parquet directory")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Timeline multiplier, 0 for as fast as possible")
+    parser.add_argument("--table", choices=["health_metrics", "environmental_data",
+                                            "activity_tracking"])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--no-kafka", action="store_true")
+    parser.add_argument("--direct-cassandra", action="store_true",
+                        help="Also write to Cassandra directly, not only via Kafka")
+    parser.add_argument("--wire-format", choices=["json", "binary"], default="json")
+    args = parser.parse_args()
+
+    replay(
+        args.path,
+        speed=args.speed,
+        table=args.table,
+        chunk_size=args.chunk_size,
+        use_kafka=not args.no_kafka,
+        use_cassandra=args.direct_cassandra,
+        wire_format=args.wire_format,
+    )
@@ -0,0 +1,287 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Local file shared by the API workers and the writers: response entries
+# (when the shared backend is used) and the per-endpoint generations that
+# writers bump to invalidate them. It sits next to this module, so every
+# process finds the same file whatever directory it was started from.
+SHARED_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "response_cache.sqlite"
+)
+
+DEFAULT_TTL = 60  # Seconds a cached response is served
+MAX_ENTRIES = 1024  # Responses kept by the in-process backend
+GENERATION_CHECK_INTERVAL = 1.0  # Seconds between reads of the generations
+PURGE_EVERY = 100  # Writes between purges of expired shared entries
+MAX_SEEN_KEYS = 100_000  # States, devices and device days a notifier remembers
+
+# Returned by backends on a miss, since None can be a cached value
+MISSING = object()
+
+
+class SqliteStore:
+    """One sqlite connection per thread on the shared cache file."""
+
+    def __init__(self, path=SHARED_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS entries "
+                    "(key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS generations "
+                    "(endpoint TEXT PRIMARY KEY, generation INTEGER)"
+                )
+            self._local.connection = connection
+        return connection
+
+
+class MemoryBackend:
+    """In-process LRU of responses, each expiring after its TTL."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteBackend(SqliteStore):
+    """
+    Responses shared by every API worker on the host, stored as JSON in the
+    shared cache file.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH):
+        super().__init__(path)
+        self._writes = 0
+
+    def get(self, key):
+        row = self.connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return MISSING if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=str), time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                connection.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+
+
+class Generations(SqliteStore):
+    """
+    Per-endpoint generation counters. Cache keys include the endpoint's
+    generation, so bumping it invalidates every cached response of the
+    endpoint in every process at once.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, check_interval=GENERATION_CHECK_INTERVAL):
+        super().__init__(path)
+        self.check_interval = check_interval
+        self._current = {}
+        self._checked_at = float("-inf")
+
+    def get(self, endpoint):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            rows = self.connection().execute("SELECT endpoint, generation FROM generations")
+            self._current = dict(rows.fetchall())
+            self._checked_at = now
+        return self._current.get(endpoint, 0)
+
+    def bump(self, endpoints):
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "INSERT INTO generations VALUES (?, 1) ON CONFLICT(endpoint) "
+                "DO UPDATE SET generation = generation + 1",
+                [(endpoint,) for endpoint in endpoints],
+            )
+        self._checked_at = float("-inf")
+
+
+class _Flight:
+    """A response being computed, which concurrent requests wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    TTL cache of endpoint responses keyed by endpoint, its generation and the
+    normalized query arguments.
+
+    Concurrent misses for the same key are coalesced: one request computes
+    the response while the others wait for it, so an expired entry costs one
+    Cassandra query however many requests arrive at once.
+    """
+
+    def __init__(self, backend=None, generations=None, ttl=DEFAULT_TTL):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.generations = generations
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def key(self, endpoint, args):
+        generation = self.generations.get(endpoint) if self.generations else 0
+        query = "&".join(f"{name}={value}" for name, value in sorted(args.items()))
+        return f"{endpoint}#{generation}?{query}"
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_or_compute(self, endpoint, args, compute, ttl=None):
+        """The cached response for (endpoint, args), computing it on a miss."""
+        key = self.key(endpoint, args)
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self._count("hits")
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count("coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            # Another worker may have filled the shared backend meanwhile
+            value = self.backend.get(key)
+            if value is MISSING:
+                self._count("misses")
+                value = compute()
+                self.backend.set(key, value, self.ttl if ttl is None else ttl)
+            else:
+                self._count("hits")
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.done.set()
+            with self._lock:
+                del self._flights[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def changed_endpoints(lookup_table, row):
+    """
+    Yield (key, endpoint) for the cached endpoints a lookup-table row can
+    change; the key identifies what is new the first time it is written.
+    """
+    if lookup_table == "devices_by_state":
+        yield ("state", row["state"]), "/states"
+    elif lookup_table == "dates_by_device":
+        yield ("device", row["device_id"]), "/device_ids"
+        yield ("day", row["device_id"], row["day"]), "/dates"
+
+
+class ChangeNotifier:
+    """
+    Write side of the invalidation. Remembers the states, devices and device
+    days this process has written, and once rows introducing new ones are
+    stored, bumps the generations of the endpoints they change.
+
+    Only the `max_seen` most recently written keys are remembered, so a
+    long-running writer stays bounded; a forgotten key that shows up again
+    just invalidates its endpoints once more.
+    """
+
+    def __init__(self, generations=None, max_seen=MAX_SEEN_KEYS):
+        self.generations = generations if generations is not None else Generations()
+        self.max_seen = max_seen
+        self._seen = OrderedDict()
+        self._unflushed = {}  # Keys observed since the last flush -> endpoint
+        self._pending = set()
+
+    def observe(self, lookup_table, row):
+        for key, endpoint in changed_endpoints(lookup_table, row):
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                continue
+            self._seen[key] = True
+            if len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+            self._unflushed[key] = endpoint
+
+    def discard(self):
+        """
+        Forget the rows observed since the last flush, which failed. Writers
+        that retry observe them again; the others never invalidate for them.
+        """
+        for key in self._unflushed:
+            self._seen.pop(key, None)
+        self._unflushed.clear()
+
+    def publish(self):
+        """Invalidate the endpoints changed by the rows observed and stored so far."""
+        self._pending.update(self._unflushed.values())
+        self._unflushed.clear()
+        if not self._pending:
+            return
+        try:
+            self.generations.bump(self._pending)
+        except sqlite3.Error as e:
+            # Cached responses then expire with their TTL instead
+            print(f"Response cache invalidation failed: {e}")
+            return
+        self._pending.clear()
@@ -0,0 +1,98 @@
+from datetime import date
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+COLUMNAR_JSON = "application/x-columnar+json"
+
+# Media types the table and aggregate endpoints can answer with, the
+# default first
+FORMATS = [JSON, NDJSON, COLUMNAR_JSON, ARROW_STREAM]
+
+BATCH_ROWS = 5000  # Rows per Arrow record batch, one driver page by default
+
+# Arrow types of the CQL column types in this keyspace
+ARROW_TYPES = {
+    "text": pa.string(),
+    "varchar": pa.string(),
+    "timestamp": pa.timestamp("ms"),
+    "date": pa.date32(),
+    "float": pa.float32(),
+    "double": pa.float64(),
+    "int": pa.int32(),
+    "bigint": pa.int64(),
+    "boolean": pa.bool_(),
+}
+
+# End-of-stream marker of the Arrow IPC stream format
+END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+def frame_batches(frame):
+    """Schema and record batches of a DataFrame."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    return table.to_batches(), table.schema
+
+
+def arrow_schema(metadata, columns=None):
+    """Arrow schema of the given columns of a table (all of them by default)."""
+    return pa.schema([
+        (column, ARROW_TYPES.get(metadata.columns[column].cql_type, pa.string()))
+        for column in (columns or list(metadata.columns))
+    ])
+
+
+def column_values(rows, field):
+    values = [getattr(row, field.name, None) for row in rows]
+    if pa.types.is_string(field.type):
+        return [None if value is None else str(value) for value in values]
+    if pa.types.is_date32(field.type):
+        # cassandra.util.Date prints as YYYY-MM-DD
+        return [None if value is None else date.fromisoformat(str(value)) for value in values]
+    return values
+
+
+def record_batches(rows, schema, batch_rows=BATCH_ROWS):
+    """Convert driver rows into record batches of `schema`, batch_rows at a time."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_rows))
+        if not chunk:
+            return
+        yield pa.record_batch(
+            [pa.array(column_values(chunk, field), type=field.type) for field in schema],
+            schema=schema,
+        )
+
+
+def arrow_stream(batches, schema):
+    """
+    Yield an Arrow IPC stream: the schema, then each record batch as soon as
+    it is converted, then the end-of-stream marker.
+    """
+    yield schema.serialize().to_pybytes()
+    for batch in batches:
+        yield batch.serialize().to_pybytes()
+    yield END_OF_STREAM
+
+
+def columnar_json(batches, schema):
+    """
+    Column-oriented body of record batches: each column once as a list, with
+    timestamps as epoch milliseconds and dates as ISO strings.
+    """
+    table = pa.Table.from_batches(list(batches), schema)
+    columns = {}
+    timestamp_columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_timestamp(column.type):
+            column = pc.cast(column.cast(pa.timestamp("ms")), pa.int64())
+            timestamp_columns.append(name)
+        elif pa.types.is_date(column.type):
+            column = pc.cast(column, pa.string())
+        columns[name] = column.to_pylist()
+    return {"columns": columns, "timestamp_columns": timestamp_columns}
@@ -0,0 +1,67 @@
+import random
+from functools import lru_cache
+
+import numpy as np
+
+# splitmix64 constants
+GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
+
+# Independent streams per device, one per kind of draw
+LOCATION_STREAM = 0
+ACTIVITY_STREAM = 1
+READINGS_STREAM = 2
+
+
+def device_seed_sequence(master_seed, device_id, stream=READINGS_STREAM):
+    """
+    Seed sequence for one device, derived from the master seed and the device
+    ID itself (not its position in a list), so a device gets the same stream
+    whichever worker or shard generates it.
+    """
+    spawn_key = (stream,) + tuple(device_id.encode("utf-8"))
+    return np.random.SeedSequence(master_seed, spawn_key=spawn_key)
+
+
+def device_random(master_seed, device_id, stream=READINGS_STREAM):
+    """Independent `random.Random` stream for one device."""
+    sequence = device_seed_sequence(master_seed, device_id, stream)
+    high, low = sequence.generate_state(2, np.uint64)
+    return random.Random((int(high) << 64) | int(low))
+
+
+@lru_cache(maxsize=None)
+def _device_key(master_seed, device_id):
+    return device_seed_sequence(master_seed, device_id).generate_state(1, np.uint64)[0]
+
+
+def device_keys(master_seed, device_ids):
+    """64-bit stream key per device for the counter-based generator below."""
+    return np.array(
+        [_device_key(master_seed, device_id) for device_id in device_ids],
+        dtype=np.uint64,
+    )
+
+
+def _mix(z):
+    z = (z ^ (z >> np.uint64(30))) * MIX_1
+    z = (z ^ (z >> np.uint64(27))) * MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+def counter_uniform(keys, counters):
+    """
+    Uniform floats in [0, 1): element i is draw number `counters[i]` of the
+    splitmix64 stream keyed by `keys[i]`. Every draw is a pure function of
+    (key, counter), so draws can be made in any order or in any process.
+    """
+    with np.errstate(over="ignore"):
+        state = keys + (counters.astype(np.uint64) + np.uint64(1)) * GAMMA
+        return (_mix(state) >> np.uint64(11)) * (1.0 / (1 << 53))
+
+
+def counter_integers(keys, counters, low, high):
+    """Integers in [low, high] (inclusive, like random.randint)."""
+    span = np.asarray(high) - np.asarray(low) + 1
+    return np.asarray(low) + (counter_uniform(keys, counters) * span).astype(np.int64)
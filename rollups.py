@@ -0,0 +1,339 @@
+import argparse
+import heapq
+import time
+import weakref
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from cassandra.concurrent import execute_concurrent
+from kafka import ConsumerRebalanceListener
+from kafka.errors import CommitFailedError
+
+from cassandra_kafka_setup import ROLLUP_WINDOWS, TOPIC_NAME
+from cassandra_writer import CassandraWriteEngine, to_datetime
+from ingest_service import POLL_TIMEOUT_MS, RETRY_BACKOFF, setup_kafka_consumer
+from stream_sinks import record_table, setup_cassandra_session
+from wire_format import decode_message
+
+ROLLUP_GROUP_ID = "health-rollups"
+ALLOWED_LATENESS = 86400.0  # Seconds of event time a window stays open after it ends
+EMIT_INTERVAL = 5.0  # Seconds between upserts of updated windows
+REPORT_INTERVAL = 30.0
+
+# Rollup timestamps are naive UTC like the rest of the keyspace
+EPOCH = datetime(1970, 1, 1)
+
+# Prepared reads of stored rollups, cached per session and table
+_prepared_reads = weakref.WeakKeyDictionary()
+
+
+def rollup_table(window):
+    return f"health_metrics_{window}"
+
+
+class WindowedAggregator:
+    """
+    Tumbling event-time windows over health_metrics readings.
+
+    Each (window size, window start, device, metric) keeps count, sum, min
+    and max. The watermark trails the largest event time seen by
+    `allowed_lateness` seconds: a window accepts readings until the watermark
+    passes its end and is then evicted, and readings for evicted windows are
+    counted as late and dropped. Windows are reported as dirty whenever they
+    change, so they can be upserted before they close.
+    """
+
+    def __init__(self, windows=ROLLUP_WINDOWS, allowed_lateness=ALLOWED_LATENESS):
+        self.windows = windows
+        self.allowed_lateness = allowed_lateness
+        # (window, start) -> {(device_id, metric_type): [count, sum, min, max]}
+        self.open = {}
+        self._ends = []  # Heap of (end, window, start) for eviction
+        self.dirty = set()
+        self.created = []
+        self.max_event_time = None
+        self.late = defaultdict(int)
+
+    @property
+    def watermark(self):
+        if self.max_event_time is None:
+            return None
+        return self.max_event_time - self.allowed_lateness
+
+    def add(self, device_id, metric_type, timestamp, value):
+        seconds = (to_datetime(timestamp) - EPOCH).total_seconds()
+        if self.max_event_time is None or seconds > self.max_event_time:
+            self.max_event_time = seconds
+        watermark = self.watermark
+
+        value = float(value)
+        for window, size in self.windows.items():
+            start = int(seconds // size) * size
+            if start + size <= watermark:
+                self.late[window] += 1
+                continue
+            group = self.open.get((window, start))
+            if group is None:
+                group = self.open[(window, start)] = {}
+                heapq.heappush(self._ends, (start + size, window, start))
+            key = (window, start, device_id, metric_type)
+            aggregate = group.get((device_id, metric_type))
+            if aggregate is None:
+                group[(device_id, metric_type)] = [1, value, value, value]
+                self.created.append(key)
+            else:
+                aggregate[0] += 1
+                aggregate[1] += value
+                if value < aggregate[2]:
+                    aggregate[2] = value
+                if value > aggregate[3]:
+                    aggregate[3] = value
+            self.dirty.add(key)
+
+    def merge(self, key, count, total, minimum, maximum):
+        """Fold a previously stored aggregate into an open window."""
+        window, start, device_id, metric_type = key
+        aggregate = self.open[(window, start)][(device_id, metric_type)]
+        aggregate[0] += count
+        aggregate[1] += total
+        aggregate[2] = min(aggregate[2], minimum)
+        aggregate[3] = max(aggregate[3], maximum)
+
+    def take_created(self):
+        created, self.created = self.created, []
+        return created
+
+    def take_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def rows(self, keys):
+        """Yield (table, row) upserts for the given window keys."""
+        for window, start, device_id, metric_type in keys:
+            count, total, minimum, maximum = self.open[(window, start)][
+                (device_id, metric_type)
+            ]
+            yield rollup_table(window), {
+                "device_id": device_id,
+                "metric_type": metric_type,
+                "timestamp": EPOCH + timedelta(seconds=start),
+                "value_count": count,
+                "value_sum": total,
+                "value_min": minimum,
+                "value_max": maximum,
+                "value_mean": total / count,
+            }
+
+    def evict(self):
+        """Drop windows the watermark has passed and return how many there were."""
+        watermark = self.watermark
+        evicted = 0
+        while self._ends and self._ends[0][0] <= watermark:
+            _, window, start = heapq.heappop(self._ends)
+            evicted += len(self.open.pop((window, start)))
+        return evicted
+
+    def drop(self, device_ids):
+        """Forget the open windows of the given devices; return how many there were."""
+        device_ids = set(device_ids)
+        dropped = 0
+        for group in self.open.values():
+            for key in [key for key in group if key[0] in device_ids]:
+                del group[key]
+                dropped += 1
+        self.dirty = {key for key in self.dirty if key[2] not in device_ids}
+        self.created = [key for key in self.created if key[2] not in device_ids]
+        return dropped
+
+    def open_windows(self):
+        return sum(len(group) for group in self.open.values())
+
+
+def prepare_read(session, table):
+    statements = _prepared_reads.setdefault(session, {})
+    if table not in statements:
+        statements[table] = session.prepare(
+            f"""
+            SELECT value_count, value_sum, value_min, value_max FROM {table}
+            WHERE device_id = ? AND metric_type = ? AND timestamp = ?;
+            """
+        )
+    return statements[table]
+
+
+class RollupService(ConsumerRebalanceListener):
+    """
+    Consumes the topic in its own consumer group and keeps the rollup tables
+    up to date.
+
+    Every `emit_interval` seconds the windows that changed are upserted
+    through the write engine and the consumed offsets are committed, so the
+    stored rollups always cover exactly the records up to the last commit.
+    After a restart, a window seen for the first time is merged with its
+    stored row before it is written again, instead of overwriting it with a
+    partial aggregate.
+
+    Records are keyed by device, so each device's windows belong to one
+    partition. Before partitions are revoked in a rebalance the windows are
+    emitted and committed, and those of the revoked partitions' devices are
+    dropped; their new owner merges the stored rows as after a restart.
+    """
+
+    def __init__(self, writer, aggregator, emit_interval=EMIT_INTERVAL):
+        self.consumer = None
+        self.writer = writer
+        self.aggregator = aggregator
+        self.emit_interval = emit_interval
+        self.session = writer.session
+        self.consumed = 0
+        self.skipped = 0
+        self.evicted = 0
+        # device_id -> (topic, partition) its readings came from
+        self.device_partitions = {}
+
+    def handle(self, message):
+        try:
+            data = decode_message(message.value)
+            table = record_table(data)
+        except Exception as e:
+            self.skipped += 1
+            print(f"Skipping undecodable record at {message.topic}/"
+                  f"{message.partition}@{message.offset}: {e}")
+            return
+        self.consumed += 1
+        if table == "health_metrics":
+            self.device_partitions[data["device_id"]] = (message.topic, message.partition)
+            self.aggregator.add(
+                data["device_id"], data["metric_type"], data["timestamp"], data["value"]
+            )
+
+    def restore(self, keys):
+        """Merge stored rollups into newly opened windows; return the keys that failed."""
+        statements = [
+            (
+                prepare_read(self.session, rollup_table(window)),
+                (device_id, metric_type, EPOCH + timedelta(seconds=start)),
+            )
+            for window, start, device_id, metric_type in keys
+        ]
+        results = execute_concurrent(
+            self.session,
+            statements,
+            concurrency=self.writer.concurrency,
+            raise_on_first_error=False,
+        )
+        failed = []
+        for key, (success, result) in zip(keys, results):
+            if not success:
+                failed.append(key)
+                continue
+            for row in result:
+                self.aggregator.merge(
+                    key, row.value_count, row.value_sum, row.value_min, row.value_max
+                )
+        return failed
+
+    def emit(self):
+        """
+        Upsert changed windows, then commit offsets and evict closed windows.
+        Returns whether the offsets were committed.
+        """
+        created = self.aggregator.take_created()
+        failed = self.restore(created) if created else []
+        dirty = self.aggregator.take_dirty()
+
+        failed_before = self.writer.rows_failed
+        for table, row in self.aggregator.rows(dirty):
+            self.writer.add(table, row)
+        self.writer.flush()
+
+        if failed or self.writer.rows_failed != failed_before:
+            # Keep everything pending and try again without committing
+            self.aggregator.created.extend(failed)
+            self.aggregator.dirty |= dirty
+            print(f"Rollup upsert failed, retrying in {RETRY_BACKOFF:.0f}s")
+            time.sleep(RETRY_BACKOFF)
+            return False
+        try:
+            self.consumer.commit()
+        except CommitFailedError as e:
+            # The group rebalanced underneath us; the revoke callback drops
+            # the windows that moved and their new owner re-reads them
+            print(f"Offset commit failed: {e}")
+            return False
+        self.evicted += self.aggregator.evict()
+        return True
+
+    def on_partitions_revoked(self, revoked):
+        if self.consumer is None or not revoked:
+            return
+        if not self.emit():
+            print("Handing over partitions with uncommitted rollups")
+        revoked = {(tp.topic, tp.partition) for tp in revoked}
+        devices = [device_id for device_id, partition in self.device_partitions.items()
+                   if partition in revoked]
+        for device_id in devices:
+            del self.device_partitions[device_id]
+        dropped = self.aggregator.drop(devices)
+        print(f"Revoked partitions: {sorted(p for _, p in revoked)}, "
+              f"dropped {dropped} open windows")
+
+    def on_partitions_assigned(self, assigned):
+        print(f"Assigned partitions: {sorted(tp.partition for tp in assigned)}")
+
+    def report(self):
+        watermark = self.aggregator.watermark
+        late = ", ".join(
+            f"{window}={count}" for window, count in self.aggregator.late.items()
+        )
+        print(
+            f"Rollups: {self.consumed} records, {self.aggregator.open_windows()} "
+            f"open windows, {self.evicted} closed, watermark "
+            f"{EPOCH + timedelta(seconds=watermark) if watermark is not None else '-'}"
+            f", late records dropped: {late or 'none'}"
+        )
+
+    def run(self, consumer):
+        self.consumer = consumer
+        last_emit = last_report = time.monotonic()
+        try:
+            while True:
+                batches = consumer.poll(timeout_ms=POLL_TIMEOUT_MS)
+                for messages in batches.values():
+                    for message in messages:
+                        self.handle(message)
+
+                now = time.monotonic()
+                if now - last_emit >= self.emit_interval:
+                    last_emit = now
+                    self.emit()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    self.report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.emit()
+            # Everything is emitted if closing the consumer revokes anything
+            self.consumer = None
+            consumer.close()
+            self.report()
+            if self.skipped:
+                print(f"Skipped {self.skipped} undecodable records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Roll up health metrics from the '{TOPIC_NAME}' topic into "
+                    f"{', '.join(ROLLUP_WINDOWS)} windows"
+    )
+    parser.add_argument("--group-id", default=ROLLUP_GROUP_ID)
+    parser.add_argument("--allowed-lateness", type=float, default=ALLOWED_LATENESS,
+                        help="Seconds of event time a window accepts late readings")
+    parser.add_argument("--emit-interval", type=float, default=EMIT_INTERVAL)
+    args = parser.parse_args()
+
+    writer = CassandraWriteEngine(setup_cassandra_session())
+    aggregator = WindowedAggregator(allowed_lateness=args.allowed_lateness)
+    service = RollupService(writer, aggregator, args.emit_interval)
+    service.run(setup_kafka_consumer(args.group_id, listener=service))
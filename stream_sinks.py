@@ -0,0 +1,85 @@
+import json
+import time
+from cassandra.cluster import Cluster
+from kafka import KafkaProducer
+from cassandra_kafka_setup import TOPIC_NAME
+from cassandra_writer import INSERT_QUERIES, bind_values, lookup_rows, prepare_insert
+from response_cache import SHARED_CACHE_PATH, ChangeNotifier, Generations
+from time_buckets import table_bucket
+from kafka_throughput import THROUGHPUT_PRODUCER_CONFIG
+from wire_format import encode_record
+
+# Constants for Kafka
+BOOTSTRAP_SERVERS = "localhost:9092"
+# TOPIC_NAME = "apple-watch-iot-2"
+
+# Message serializers by wire format
+SERIALIZERS = {
+    "json": lambda x: json.dumps(x).encode("utf-8"),
+    "binary": encode_record,
+}
+
+# Kafka Producer setup
+def setup_kafka_producer(throughput=False, wire_format="json"):
+    config = THROUGHPUT_PRODUCER_CONFIG if throughput else {}
+    return KafkaProducer(
+        bootstrap_servers=[BOOTSTRAP_SERVERS],
+        value_serializer=SERIALIZERS[wire_format],
+        **config,
+    )
+
+# Cassandra session setup
+def setup_cassandra_session():
+    cluster = Cluster(["127.0.0.1"])
+    session = cluster.connect()
+    session.set_keyspace("apple_watch_iot")
+    return session
+
+# Last known (state, town) per device, for the lookup tables
+_device_places = {}
+
+# Invalidates the API's cached /states, /device_ids and /dates responses
+_changes = ChangeNotifier(Generations(SHARED_CACHE_PATH))
+
+# Insert data into Cassandra
+def send_to_cassandra(session, table, data):
+    if table not in INSERT_QUERIES:
+        print(f"Unknown table: {table}")
+        return
+    session.execute(
+        prepare_insert(session, table),
+        bind_values(table, data, table_bucket(session, table)),
+    )
+    for lookup_table, row in lookup_rows(table, data, _device_places):
+        session.execute(prepare_insert(session, lookup_table), bind_values(lookup_table, row))
+        _changes.observe(lookup_table, row)
+    _changes.publish()
+    print(f"Inserted into Cassandra ({table}): {data}")
+
+# Send data to Kafka, keyed by device_id so each device stays on one
+# partition. Without a partitioner the client's murmur2 key hash is used.
+def send_to_kafka(producer, data, tracker=None, partitioner=None):
+    key = data["device_id"].encode("utf-8")
+    partition = None
+    if partitioner is not None:
+        partition = partitioner.partition(producer, TOPIC_NAME, key)
+    if tracker is not None:
+        # Throughput mode: no per-message print or sleep, delivery is
+        # tracked through callbacks
+        tracker.send(producer, TOPIC_NAME, data, key=key, partition=partition)
+        return
+    producer.send(TOPIC_NAME, value=data, key=key, partition=partition)
+    print(f"Sent to Kafka: {data}")
+    time.sleep(0.01)  # Reduced delay for faster data generation
+
+
+HEALTH_METRIC_TYPES = ["heart_rate", "calories_burned", "stress_level"]
+
+
+# Pick the Cassandra table a generated reading belongs to
+def record_table(data):
+    if data.get("metric_type") in HEALTH_METRIC_TYPES:
+        return "health_metrics"
+    if "activity_type" in data:
+        return "activity_tracking"
+    return "environmental_data"
@@ -0,0 +1,54 @@
+import weakref
+from datetime import date, datetime, timedelta
+
+# Bucket units a time-series table can be partitioned by. The unit is also
+# the name of the bucket column in the partition key, e.g.
+# PRIMARY KEY ((device_id, day), metric_type, timestamp).
+BUCKET_UNITS = ("day", "week")
+
+# Tables that may carry a bucket column
+TIME_SERIES_TABLES = ("health_metrics", "activity_tracking", "environmental_data")
+
+# Bucket unit per table, read once from the schema of each live session
+_bucket_cache = weakref.WeakKeyDictionary()
+
+
+def bucket_start(timestamp, unit):
+    """First day of the `unit` bucket holding `timestamp` (weeks start on Monday)."""
+    day = timestamp.date() if isinstance(timestamp, datetime) else timestamp
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def buckets_between(start, end, unit):
+    """Buckets overlapping [start, end], oldest first."""
+    bucket = bucket_start(start, unit)
+    last = bucket_start(end, unit)
+    step = timedelta(days=7 if unit == "week" else 1)
+    buckets = []
+    while bucket <= last:
+        buckets.append(bucket)
+        bucket += step
+    return buckets
+
+
+def table_bucket(session, table):
+    """The bucket unit of `table` in the session's keyspace, or None if unbucketed."""
+    units = _bucket_cache.setdefault(session, {})
+    if table not in units:
+        unit = None
+        keyspace = session.cluster.metadata.keyspaces.get(session.keyspace)
+        if table in TIME_SERIES_TABLES and keyspace is not None and table in keyspace.tables:
+            for column in keyspace.tables[table].partition_key:
+                if column.name in BUCKET_UNITS:
+                    unit = column.name
+        units[table] = unit
+    return units[table]
+
+
+def days_to_buckets(days, unit):
+    """Distinct buckets holding the given days, oldest first."""
+    # `date` columns come back from the driver as cassandra.util.Date
+    return sorted({bucket_start(day if isinstance(day, date) else day.date(), unit)
+                   for day in days})
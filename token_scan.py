@@ -0,0 +1,211 @@
+import argparse
+import queue
+import threading
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Murmur3Partitioner token bounds
+MIN_TOKEN = -(2**63)
+MAX_TOKEN = 2**63 - 1
+
+CONCURRENCY = 16  # Token ranges scanned at once
+SPLITS_PER_WORKER = 4  # Ranges per worker, so slow ranges don't hold up the tail
+FETCH_SIZE = 5000  # Rows per page
+QUEUE_PAGES = 64  # Pages buffered between the scanning threads and the reader
+
+FILTER_OPERATORS = {"=", "<", "<=", ">", ">="}
+
+# Marks the end of one token range's pages
+DONE = object()
+
+# Prepared scan statements per query, cached per live session
+_prepared_scans = weakref.WeakKeyDictionary()
+
+
+def split_ring(splits):
+    """Split the whole token ring into `splits` contiguous (start, end] ranges."""
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + i * step for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class TokenRangeScan:
+    """
+    Full-table scan split over sub-ranges of the token ring.
+
+    Each range is read with its own paged query of the form
+    `WHERE token(<partition key>) > ? AND token(<partition key>) <= ?`, and
+    up to `concurrency` ranges are read at once, so a scan is spread over
+    every replica instead of being one sequential walk through a single
+    coordinator. Only the projected `columns` are fetched. `filters` are
+    (column, operator, value) conditions applied on the server with
+    ALLOW FILTERING.
+    """
+
+    def __init__(self, session, table, columns=None, filters=(),
+                 concurrency=CONCURRENCY, splits=None, fetch_size=FETCH_SIZE):
+        metadata = session.cluster.metadata.keyspaces[session.keyspace].tables[table]
+        columns = list(columns) if columns else list(metadata.columns)
+        filters = list(filters)
+        unknown = [
+            column
+            for column in columns + [column for column, _, _ in filters]
+            if column not in metadata.columns
+        ]
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {', '.join(unknown)}")
+        for column, operator, _ in filters:
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported operator for {column}: {operator}")
+
+        partition_key = ", ".join(column.name for column in metadata.partition_key)
+        conditions = [f"token({partition_key}) > ?", f"token({partition_key}) <= ?"]
+        conditions += [f"{column} {operator} ?" for column, operator, _ in filters]
+        query = f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(conditions)}"
+        if filters:
+            query += " ALLOW FILTERING"
+
+        self.session = session
+        self.table = table
+        self.columns = columns
+        self.concurrency = concurrency
+        statements = _prepared_scans.setdefault(session, {})
+        key = (query, fetch_size)
+        if key not in statements:
+            statement = session.prepare(query + ";")
+            statement.fetch_size = fetch_size
+            statements[key] = statement
+        self.statement = statements[key]
+        self.filter_values = [value for _, _, value in filters]
+        self.ranges = split_ring(splits or concurrency * SPLITS_PER_WORKER)
+
+    def parameters(self):
+        """Bound values of the scan query, one list per token range."""
+        return [[start, end] + self.filter_values for start, end in self.ranges]
+
+    def pages(self, token_range):
+        """Yield the pages of rows in one token range."""
+        start, end = token_range
+        result = self.session.execute(self.statement, [start, end] + self.filter_values)
+        while True:
+            yield result.current_rows
+            if not result.has_more_pages:
+                return
+            result.fetch_next_page()
+
+    def rows(self):
+        """
+        Yield every row, in no particular order, as soon as its page arrives.
+        Scanning threads block once QUEUE_PAGES pages are waiting, so a slow
+        reader holds the scan back instead of buffering the table.
+        """
+        pages = queue.Queue(QUEUE_PAGES)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def scan(token_range):
+            try:
+                for page in self.pages(token_range):
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(DONE)
+
+        executor = ThreadPoolExecutor(self.concurrency)
+        for token_range in self.ranges:
+            executor.submit(scan, token_range)
+        remaining = len(self.ranges)
+        try:
+            while remaining:
+                item = pages.get()
+                if item is DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            # Also reached when the reader stops early
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def aggregate(self, partial, combine):
+        """
+        Run `partial(rows)` over each token range inside the worker pool and
+        return `combine(partials)`, so only one small partial result per range
+        reaches the caller instead of every row.
+        """
+        def scan(token_range):
+            return partial(row for page in self.pages(token_range) for row in page)
+
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            partials = list(executor.map(scan, self.ranges))
+        return combine(partials)
+
+
+def count_rows():
+    """partial/combine pair counting the scanned rows."""
+    return (lambda rows: sum(1 for _ in rows)), sum
+
+
+def mean_by(key, value):
+    """partial/combine pair averaging column `value` per distinct `key`."""
+    def partial(rows):
+        sums = defaultdict(lambda: [0, 0.0])
+        for row in rows:
+            current = getattr(row, value)
+            if current is None:
+                continue
+            total = sums[getattr(row, key)]
+            total[0] += 1
+            total[1] += current
+        return sums
+
+    def combine(partials):
+        totals = defaultdict(lambda: [0, 0.0])
+        for sums in partials:
+            for group, (count, subtotal) in sums.items():
+                totals[group][0] += count
+                totals[group][1] += subtotal
+        return {group: subtotal / count for group, (count, subtotal) in totals.items()}
+
+    return partial, combine
+
+
+def benchmark(table, columns, concurrencies):
+    from stream_sinks import setup_cassandra_session
+
+    session = setup_cassandra_session()
+    baseline = None
+    for concurrency in concurrencies:
+        scan = TokenRangeScan(session, table, columns, concurrency=concurrency)
+        start = time.perf_counter()
+        rows = sum(1 for _ in scan.rows())
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"concurrency {concurrency:>3}: {rows} rows in {elapsed:.2f}s "
+              f"({rows / elapsed if elapsed else 0:,.0f} rows/s, "
+              f"{baseline / elapsed if elapsed else 0:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time a token-range parallel scan of a table at several concurrencies"
+    )
+    parser.add_argument("table")
+    parser.add_argument("--columns", nargs="+", help="Columns to project")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    args = parser.parse_args()
+    benchmark(args.table, args.columns, args.concurrency)
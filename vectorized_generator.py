@@ -0,0 +1,258 @@
+import argparse
+import json
+import math
+import random
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from device_fleet import (
+    ACTIVITY_DATA,
+    DEVICE_LOCATIONS,
+    assign_device_locations,
+    generate_data_for_device,
+    town_weather,
+)
+from rng_streams import counter_integers, device_keys
+
+# Activity lookup arrays, indexed by activity code
+ACTIVITY_NAMES = list(ACTIVITY_DATA.keys())
+HEART_RATE_LOW = np.array([ACTIVITY_DATA[a]["heart_rate"][0] for a in ACTIVITY_NAMES])
+HEART_RATE_HIGH = np.array([ACTIVITY_DATA[a]["heart_rate"][1] for a in ACTIVITY_NAMES])
+CALORIES_PER_MIN = np.array([ACTIVITY_DATA[a]["calories_per_min"] for a in ACTIVITY_NAMES])
+STRESS_LEVEL = np.array([ACTIVITY_DATA[a]["stress_level"] for a in ACTIVITY_NAMES])
+
+
+def day_start(day=None):
+    """Midnight of `day` (a date), today by default."""
+    day = day if day is not None else date.today()
+    return datetime(day.year, day.month, day.day)
+
+
+class FleetReadings:
+    """
+    Columnar readings for N devices x M ticks, stored device-major.
+
+    Per-tick columns are NumPy arrays of length N * M. Device and town
+    attributes are stored once and referenced through `device_index` and
+    `town_index`, so nothing is formatted until a sink asks for it.
+    """
+
+    def __init__(self, device_ids, device_locations, ticks, timestamp, activity,
+                 heart_rate, calories_burned, stress_level):
+        self.device_ids = list(device_ids)
+        self.ticks = ticks
+        self.device_index = np.repeat(
+            np.arange(len(self.device_ids), dtype=np.int32), ticks
+        )
+        self.timestamp = timestamp
+        self.activity = activity
+        self.heart_rate = heart_rate
+        self.calories_burned = calories_burned
+        self.stress_level = stress_level
+
+        locations = [device_locations[device_id] for device_id in self.device_ids]
+        self.towns = sorted({location["town"] for location in locations})
+        town_codes = {town: code for code, town in enumerate(self.towns)}
+        self.town_index = np.array(
+            [town_codes[location["town"]] for location in locations], dtype=np.int16
+        )
+        self.states = [location["state"] for location in locations]
+        self.latitude = np.array([location["latitude"] for location in locations])
+        self.longitude = np.array([location["longitude"] for location in locations])
+
+        weather = [town_weather(town) for town in self.towns]
+        self.temperature = np.array([w[0] for w in weather])
+        self.humidity = np.array([w[1] for w in weather])
+
+    def __len__(self):
+        return len(self.timestamp)
+
+
+def generate_fleet_readings(device_ids, ticks=5, device_locations=None,
+                            base_time=None, rng=None, seed=None, tick_offset=0):
+    """
+    Generate `ticks` readings per device as NumPy arrays.
+
+    Matches generate_data_for_device: each tick lands at a random minute of
+    `base_time`'s day (today by default), picks a random activity, draws the
+    heart rate from the activity's range and burns calories for a 10-60
+    minute duration.
+
+    With a master `seed`, every value is drawn from the device's own stream
+    at position (tick_offset + tick), so a device's readings are identical no
+    matter which other devices, shards or processes generate alongside it.
+    The day is then part of the output and has to be given as `base_time`.
+    Otherwise values come from `rng` (a NumPy Generator).
+    """
+    if device_locations is None:
+        device_locations = DEVICE_LOCATIONS
+    if base_time is None:
+        if seed is not None:
+            raise ValueError("base_time is required with a seed, or runs differ by day")
+        base_time = day_start()
+
+    total = len(device_ids) * ticks
+    if seed is not None:
+        keys = np.repeat(device_keys(seed, device_ids), ticks)
+        tick = np.tile(np.arange(tick_offset, tick_offset + ticks, dtype=np.uint64),
+                       len(device_ids))
+
+        # One counter per (tick, field) in each device's stream
+        def draw(field, low, high):
+            return counter_integers(keys, tick * np.uint64(5) + np.uint64(field),
+                                    low, high)
+    else:
+        if rng is None:
+            rng = np.random.default_rng()
+
+        def draw(field, low, high):
+            return rng.integers(low, np.asarray(high) + 1, total)
+
+    minutes = draw(0, 0, 23) * 60 + draw(1, 0, 59)
+    timestamp = np.datetime64(base_time, "m") + minutes.astype("timedelta64[m]")
+
+    activity = draw(2, 0, len(ACTIVITY_NAMES) - 1).astype(np.int8)
+    heart_rate = draw(3, HEART_RATE_LOW[activity], HEART_RATE_HIGH[activity])
+    duration = draw(4, 10, 60)
+    calories_burned = CALORIES_PER_MIN[activity] * duration
+    stress_level = STRESS_LEVEL[activity]
+
+    return FleetReadings(
+        device_ids,
+        device_locations,
+        ticks,
+        timestamp,
+        activity,
+        heart_rate,
+        calories_burned,
+        stress_level,
+    )
+
+
+def iter_records(readings):
+    """
+    Yield readings as the same six dicts per tick that generate_data_for_device
+    builds. Strings are formatted once per device or town where possible.
+    """
+    timestamps = np.datetime_as_string(readings.timestamp.astype("datetime64[s]"))
+    locations = [
+        f"{lat:.6f}, {lon:.6f}"
+        for lat, lon in zip(readings.latitude.tolist(), readings.longitude.tolist())
+    ]
+    temperatures = [f"{t:.1f}°C" for t in readings.temperature.tolist()]
+    humidities = [f"{h:.1f}%" for h in readings.humidity.tolist()]
+    town_index = readings.town_index.tolist()
+
+    columns = zip(
+        readings.device_index.tolist(),
+        timestamps.tolist(),
+        readings.heart_rate.tolist(),
+        readings.calories_burned.tolist(),
+        readings.stress_level.tolist(),
+    )
+    for device, timestamp, heart_rate, calories, stress in columns:
+        device_id = readings.device_ids[device]
+        town_code = town_index[device]
+        yield {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "metric_type": "heart_rate",
+            "value": heart_rate,
+            "unit": "bpm",
+        }
+        yield {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "metric_type": "calories_burned",
+            "value": calories,
+            "unit": "kcal",
+        }
+        yield {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "metric_type": "stress_level",
+            "value": stress,
+            "unit": "level",
+        }
+        yield {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "data_type": "location",
+            "value": locations[device],
+            "town": readings.towns[town_code],
+            "state": readings.states[device],
+        }
+        yield {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "data_type": "temperature",
+            "value": temperatures[town_code],
+        }
+        yield {
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "data_type": "humidity",
+            "value": humidities[town_code],
+        }
+
+
+def iter_json(readings):
+    """Yield each record serialized the way the Kafka producer does."""
+    for record in iter_records(readings):
+        yield json.dumps(record).encode("utf-8")
+
+
+def benchmark(num_devices, ticks, seed):
+    ids = [f"device_{i:06}" for i in range(1, num_devices + 1)]
+    locations = assign_device_locations(ids, seed=seed)
+    DEVICE_LOCATIONS.update(locations)
+
+    # generate_data_for_device always produces 5 ticks per call
+    calls = math.ceil(ticks / 5)
+    random.seed(seed)
+    start = time.perf_counter()
+    reference_rows = 0
+    for _ in range(calls):
+        for device_id in ids:
+            reference_rows += len(generate_data_for_device(device_id))
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    readings = generate_fleet_readings(
+        ids, ticks=calls * 5, device_locations=locations, base_time=day_start(),
+        seed=seed,
+    )
+    columnar_time = time.perf_counter() - start
+    columnar_rows = len(readings) * 6
+
+    start = time.perf_counter()
+    json_bytes = sum(len(message) for message in iter_json(readings))
+    json_time = time.perf_counter() - start
+
+    print(f"{num_devices} devices x {calls * 5} ticks")
+    print(
+        f"generate_data_for_device: {reference_rows} rows in {reference_time:.3f}s "
+        f"({reference_rows / reference_time:,.0f} rows/s)"
+    )
+    print(
+        f"generate_fleet_readings:  {columnar_rows} rows in {columnar_time:.3f}s "
+        f"({columnar_rows / columnar_time:,.0f} rows/s, "
+        f"{reference_time / columnar_time:.1f}x faster)"
+    )
+    print(
+        f"  + JSON sink:            {json_bytes} bytes in {json_time:.3f}s "
+        f"({columnar_rows / (columnar_time + json_time):,.0f} rows/s end to end)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the columnar generator against generate_data_for_device"
+    )
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.devices, args.ticks, args.seed)
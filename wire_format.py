@@ -0,0 +1,230 @@
+import argparse
+import json
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+
+from cassandra_writer import to_datetime
+
+# Bump when the layout changes; decoders reject versions they don't know
+SCHEMA_VERSION = 1
+
+KIND_HEALTH = 1
+KIND_ENVIRONMENT = 2
+KIND_ACTIVITY = 3
+
+# Enum code tables. Code 0 means the string is sent inline after the fixed
+# fields. These lists are append-only: reordering them breaks old messages.
+METRIC_TYPES = ["heart_rate", "calories_burned", "stress_level"]
+DATA_TYPES = ["location", "temperature", "humidity"]
+ACTIVITY_TYPES = ["biking", "walking", "running", "sleeping", "working", "cycling"]
+UNITS = ["bpm", "kcal", "level", "calories", "steps", "meters", "°C", "%", ""]
+STATES = ["Arizona", "California", "Texas", "New York"]
+TOWNS = [
+    "Tempe", "Phoenix", "Scottsdale",
+    "Los Angeles", "San Francisco", "San Diego",
+    "Austin", "Dallas", "Houston",
+    "New York City", "Buffalo", "Rochester",
+]
+
+# Unit suffix carried in environmental value strings
+DATA_TYPE_UNITS = {"temperature": "°C", "humidity": "%", "location": ""}
+
+# Fixed-width layouts (little endian), followed by the length-prefixed
+# device_id and any inline enum strings
+HEADER = struct.Struct("<BB")
+# timestamp_ms, type code, unit code, value
+MEASUREMENT = struct.Struct("<qBBf")
+# timestamp_ms, data_type code, unit code, town code, state code, value/lat, lon
+ENVIRONMENT = struct.Struct("<qBBBBdd")
+STRING_LENGTH = struct.Struct("<B")
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _codes(names):
+    return {name: code for code, name in enumerate(names, start=1)}
+
+
+METRIC_CODES = _codes(METRIC_TYPES)
+DATA_TYPE_CODES = _codes(DATA_TYPES)
+ACTIVITY_CODES = _codes(ACTIVITY_TYPES)
+UNIT_CODES = _codes(UNITS)
+STATE_CODES = _codes(STATES)
+TOWN_CODES = _codes(TOWNS)
+
+
+def to_epoch_ms(value):
+    value = to_datetime(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_ms(ms):
+    return (EPOCH + timedelta(milliseconds=ms)).isoformat()
+
+
+def _pack_string(value):
+    data = value.encode("utf-8")
+    if len(data) > 255:
+        raise ValueError(f"String too long for wire format: {value[:32]}...")
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def _unpack_string(payload, offset):
+    (length,) = STRING_LENGTH.unpack_from(payload, offset)
+    offset += STRING_LENGTH.size
+    return payload[offset : offset + length].decode("utf-8"), offset + length
+
+
+def _enum(value, codes, inline):
+    code = codes.get(value, 0)
+    if code == 0:
+        inline.append(value)
+    return code
+
+
+def _enum_value(code, names, inline):
+    if code == 0:
+        return inline.pop(0)
+    return names[code - 1]
+
+
+def encode_record(data):
+    """Encode a health, environmental or activity reading to bytes."""
+    inline = []
+    if "metric_type" in data or "activity_type" in data:
+        if "metric_type" in data:
+            kind = KIND_HEALTH
+            type_code = _enum(data["metric_type"], METRIC_CODES, inline)
+        else:
+            kind = KIND_ACTIVITY
+            type_code = _enum(data["activity_type"], ACTIVITY_CODES, inline)
+        unit_code = _enum(data.get("unit", ""), UNIT_CODES, inline)
+        body = MEASUREMENT.pack(
+            to_epoch_ms(data["timestamp"]), type_code, unit_code, float(data["value"])
+        )
+    else:
+        kind = KIND_ENVIRONMENT
+        data_type = data["data_type"]
+        type_code = _enum(data_type, DATA_TYPE_CODES, inline)
+        unit = DATA_TYPE_UNITS.get(data_type, "")
+        unit_code = _enum(unit, UNIT_CODES, inline)
+        town_code = _enum(data.get("town", ""), TOWN_CODES, inline)
+        state_code = _enum(data.get("state", ""), STATE_CODES, inline)
+        if data_type == "location":
+            first, second = (float(part) for part in data["value"].split(","))
+        else:
+            first, second = float(str(data["value"]).replace(unit, "")), 0.0
+        body = ENVIRONMENT.pack(
+            to_epoch_ms(data["timestamp"]),
+            type_code,
+            unit_code,
+            town_code,
+            state_code,
+            first,
+            second,
+        )
+
+    parts = [HEADER.pack(SCHEMA_VERSION, kind), body, _pack_string(data["device_id"])]
+    parts.extend(_pack_string(value) for value in inline)
+    return b"".join(parts)
+
+
+def decode_record(payload):
+    """Decode bytes produced by encode_record back into a reading dict."""
+    version, kind = HEADER.unpack_from(payload, 0)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported wire format version: {version}")
+    offset = HEADER.size
+
+    if kind in (KIND_HEALTH, KIND_ACTIVITY):
+        timestamp, type_code, unit_code, value = MEASUREMENT.unpack_from(payload, offset)
+        offset += MEASUREMENT.size
+        codes = (type_code, unit_code)
+    elif kind == KIND_ENVIRONMENT:
+        fields = ENVIRONMENT.unpack_from(payload, offset)
+        offset += ENVIRONMENT.size
+        timestamp, type_code, unit_code, town_code, state_code, first, second = fields
+        codes = (type_code, unit_code, town_code, state_code)
+    else:
+        raise ValueError(f"Unknown record kind: {kind}")
+
+    device_id, offset = _unpack_string(payload, offset)
+    inline = []
+    for _ in range(sum(1 for code in codes if code == 0)):
+        string, offset = _unpack_string(payload, offset)
+        inline.append(string)
+
+    record = {"device_id": device_id, "timestamp": from_epoch_ms(timestamp)}
+    if kind == KIND_HEALTH:
+        record["metric_type"] = _enum_value(type_code, METRIC_TYPES, inline)
+        record["value"] = value
+        record["unit"] = _enum_value(unit_code, UNITS, inline)
+    elif kind == KIND_ACTIVITY:
+        record["activity_type"] = _enum_value(type_code, ACTIVITY_TYPES, inline)
+        record["value"] = value
+        record["unit"] = _enum_value(unit_code, UNITS, inline)
+    else:
+        data_type = _enum_value(type_code, DATA_TYPES, inline)
+        unit = _enum_value(unit_code, UNITS, inline)
+        town = _enum_value(town_code, TOWNS, inline)
+        state = _enum_value(state_code, STATES, inline)
+        record["data_type"] = data_type
+        if data_type == "location":
+            record["value"] = f"{first:.6f}, {second:.6f}"
+            record["town"] = town
+            record["state"] = state
+        else:
+            record["value"] = f"{first:.1f}{unit}"
+    return record
+
+
+def decode_message(payload):
+    """Decode a Kafka message value written as either JSON or binary."""
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    return decode_record(payload)
+
+
+def benchmark(num_devices, ticks):
+    from vectorized_generator import generate_fleet_readings, iter_records
+    from device_fleet import assign_device_locations
+
+    ids = [f"device_{i:06}" for i in range(1, num_devices + 1)]
+    readings = generate_fleet_readings(
+        ids, ticks=ticks, device_locations=assign_device_locations(ids)
+    )
+    records = list(iter_records(readings))
+    count = len(records)
+
+    results = {}
+    for name, encode, decode in (
+        ("json", lambda x: json.dumps(x).encode("utf-8"), json.loads),
+        ("binary", encode_record, decode_record),
+    ):
+        start = time.perf_counter()
+        messages = [encode(record) for record in records]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            decode(message)
+        decode_time = time.perf_counter() - start
+
+        results[name] = sum(len(message) for message in messages) / count
+        print(
+            f"{name:>6}: {results[name]:6.1f} bytes/msg, "
+            f"encode {count / encode_time:,.0f} msg/s, "
+            f"decode {count / decode_time:,.0f} msg/s"
+        )
+    print(f"binary messages are {results['binary'] / results['json']:.0%} of JSON size")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark binary vs. JSON messages")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.devices, args.ticks)